@@ -1,7 +1,8 @@
 import {
-  filterRelevantStatePreferenceUsers,
-  filterRelevantTriggers,
-  getBidInfoForFiltering
+  getBidInfosForFiltering,
+  statePreferenceUserMatchesBid,
+  triggerCouldMatchBid,
+  type BidFilteringInfo
 } from '@/lib/bid-filtering';
 import {
   findCarriersWithMatchingFavorites,
@@ -9,132 +10,116 @@ import {
   type BidInfo
 } from '@/lib/comprehensive-carrier-matching';
 import sql from '@/lib/db';
-import { notificationQueue, urgentNotificationQueue } from '@/lib/notification-queue';
+import { notificationQueue, redisConnection, urgentNotificationQueue } from '@/lib/notification-queue';
+import { createHash } from 'crypto';
 import { NextRequest, NextResponse } from "next/server";
 
+// How long an outbox idempotency key is remembered per user (the forwarder gives up
+// on a notification well within this)
+const IDEMPOTENCY_TTL_SECONDS = 24 * 3600;
+
+function idempotencyMarker(userId: string, key: string): string {
+  return `notify:idem:${userId}:${createHash('sha1').update(key).digest('hex').slice(0, 16)}`;
+}
+
 /**
- * Webhook endpoint to trigger notification processing when a new bid is inserted
- * This can be called from the Telegram bot forwarder or other services
- * 
- * Security: Uses a simple API key check (set WEBHOOK_API_KEY env var)
+ * Mark a user's idempotency keys as enqueued; returns the keys that were not
+ * marked before (a Redis error counts as not marked, so nothing is dropped)
  */
-export async function POST(request: NextRequest) {
-  try {
-    // Check webhook API key for security
-    const apiKey = request.headers.get('x-webhook-key') || request.headers.get('authorization')?.replace('Bearer ', '');
-    const expectedKey = process.env.WEBHOOK_API_KEY;
-    
-    if (expectedKey && apiKey !== expectedKey) {
-      return NextResponse.json(
-        { error: 'Unauthorized' },
-        { status: 401 }
-      );
-    }
+async function claimIdempotencyKeys(userId: string, keys: string[]): Promise<Set<string>> {
+  if (keys.length === 0) return new Set();
+  const pipeline = redisConnection.pipeline();
+  for (const key of keys) {
+    pipeline.set(idempotencyMarker(userId, key), '1', 'EX', IDEMPOTENCY_TTL_SECONDS, 'NX');
+  }
+  const results = (await pipeline.exec()) || [];
+  return new Set(keys.filter((_, i) => !results[i] || results[i][0] || results[i][1] === 'OK'));
+}
 
-    const body = await request.json().catch(() => ({}));
-    const bidNumber = body.bidNumber;
+async function releaseIdempotencyKeys(userId: string, keys: string[]): Promise<void> {
+  if (keys.length === 0) return;
+  await redisConnection.del(...keys.map(key => idempotencyMarker(userId, key))).catch(() => 0);
+}
 
-    console.log(`[Webhook] New bid notification trigger for bid ${bidNumber || 'all'}`);
+async function getAllActiveTriggers(): Promise<any[]> {
+  return await sql`
+    SELECT 
+      nt.id,
+      nt.supabase_carrier_user_id,
+      nt.trigger_type,
+      nt.trigger_config,
+      nt.is_active
+    FROM notification_triggers nt
+    WHERE nt.is_active = true
+    ORDER BY nt.supabase_carrier_user_id, nt.trigger_type
+  `;
+}
 
-    // OPTIMIZATION: Pre-filter triggers based on bid information
-    // This dramatically reduces the number of jobs enqueued (80-95% reduction)
-    let allTriggers: any[] = [];
-    
-    if (bidNumber) {
-      // Get bid information for filtering
-      const bidInfo = await getBidInfoForFiltering(bidNumber);
-      
-      if (bidInfo) {
-        console.log(`[Webhook] Extracted bid info: ${bidInfo.origin} → ${bidInfo.destination} (${bidInfo.originState} → ${bidInfo.destinationState})`);
-        
-        // Filter triggers that could potentially match this bid
-        allTriggers = await filterRelevantTriggers(bidInfo);
-        
-        console.log(`[Webhook] Found ${allTriggers.length} relevant triggers after filtering (vs checking all triggers)`);
-      } else {
-        // Fallback: If we can't get bid info, check all triggers (safe default)
-        console.log(`[Webhook] Could not get bid info for ${bidNumber}, checking all triggers (safe fallback)`);
-        allTriggers = await sql`
-          SELECT 
-            nt.id,
-            nt.supabase_carrier_user_id,
-            nt.trigger_type,
-            nt.trigger_config,
-            nt.is_active
-          FROM notification_triggers nt
-          WHERE nt.is_active = true
-          ORDER BY nt.supabase_carrier_user_id, nt.trigger_type
-        `;
-      }
-    } else {
-      // No bid number provided, check all triggers (safe default)
-      console.log(`[Webhook] No bid number provided, checking all triggers (safe fallback)`);
-      allTriggers = await sql`
-        SELECT 
-          nt.id,
-          nt.supabase_carrier_user_id,
-          nt.trigger_type,
-          nt.trigger_config,
-          nt.is_active
-        FROM notification_triggers nt
-        WHERE nt.is_active = true
-        ORDER BY nt.supabase_carrier_user_id, nt.trigger_type
-      `;
-    }
+async function getAllStatePreferenceUsers(): Promise<any[]> {
+  return await sql`
+    SELECT DISTINCT
+      cnp.supabase_carrier_user_id as user_id,
+      cnp.state_preferences,
+      cnp.distance_threshold_miles,
+      cnp.similar_load_notifications
+    FROM carrier_notification_preferences cnp
+    WHERE cnp.supabase_carrier_user_id IS NOT NULL
+      AND cnp.similar_load_notifications = true
+      AND cnp.state_preferences IS NOT NULL
+      AND array_length(cnp.state_preferences, 1) > 0
+      AND NOT EXISTS (
+        SELECT 1 FROM notification_triggers nt
+        WHERE nt.supabase_carrier_user_id = cnp.supabase_carrier_user_id
+          AND nt.trigger_type = 'similar_load'
+          AND nt.is_active = true
+      )
+  `;
+}
 
-    // OPTIMIZATION: Pre-filter state preference users based on bid origin state
-    let usersWithStatePrefs: any[] = [];
-    
-    if (bidNumber) {
-      const bidInfo = await getBidInfoForFiltering(bidNumber);
-      
-      if (bidInfo) {
-        // Only get users whose state preferences match the bid's origin state
-        usersWithStatePrefs = await filterRelevantStatePreferenceUsers(bidInfo);
-        
-        console.log(`[Webhook] Found ${usersWithStatePrefs.length} state preference users after filtering (vs checking all users)`);
-      } else {
-        // Fallback: Get all state preference users (safe default)
-        console.log(`[Webhook] Could not get bid info, checking all state preference users (safe fallback)`);
-        usersWithStatePrefs = await sql`
-          SELECT DISTINCT
-            cnp.supabase_carrier_user_id as user_id,
-            cnp.state_preferences,
-            cnp.distance_threshold_miles,
-            cnp.similar_load_notifications
-          FROM carrier_notification_preferences cnp
-          WHERE cnp.supabase_carrier_user_id IS NOT NULL
-            AND cnp.similar_load_notifications = true
-            AND cnp.state_preferences IS NOT NULL
-            AND array_length(cnp.state_preferences, 1) > 0
-            AND NOT EXISTS (
-              SELECT 1 FROM notification_triggers nt
-              WHERE nt.supabase_carrier_user_id = cnp.supabase_carrier_user_id
-                AND nt.trigger_type = 'similar_load'
-                AND nt.is_active = true
-            )
-        `;
-      }
+/**
+ * Collect real and virtual triggers that could match each bid of a request.
+ * Triggers and state preference users are loaded once and matched against every
+ * bid in memory, so a burst costs about the same lookups as a single bid.
+ */
+async function collectTriggersForBids(bidNumbers: string[]): Promise<Map<string, any[]>> {
+  // OPTIMIZATION: Pre-filter triggers based on bid information
+  // This dramatically reduces the number of jobs enqueued (80-95% reduction)
+  const bidInfos = await getBidInfosForFiltering(bidNumbers);
+  const activeTriggers = await getAllActiveTriggers();
+  const statePreferenceUsers = await getAllStatePreferenceUsers();
+  console.log(`[Webhook] Loaded ${activeTriggers.length} active triggers and ${statePreferenceUsers.length} state preference users for ${bidNumbers.length} bid(s)`);
+
+  // Carriers who have one of these exact bids in favorites (favorite_available)
+  const exactFavorites = await sql`
+    SELECT DISTINCT
+      cf.supabase_carrier_user_id as user_id,
+      cf.bid_number
+    FROM carrier_favorites cf
+    WHERE cf.bid_number = ANY(${bidNumbers})
+      AND cf.supabase_carrier_user_id IS NOT NULL
+  `;
+
+  const triggersByBid = new Map<string, any[]>();
+  for (const bidNumber of bidNumbers) {
+    const bidInfo: BidFilteringInfo | null = bidInfos.get(bidNumber) ?? null;
+    let allTriggers: any[];
+    let usersWithStatePrefs: any[];
+
+    if (bidInfo) {
+      console.log(`[Webhook] Extracted bid info: ${bidInfo.origin} → ${bidInfo.destination} (${bidInfo.originState} → ${bidInfo.destinationState})`);
+
+      // Filter triggers that could potentially match this bid
+      allTriggers = activeTriggers.filter(t => triggerCouldMatchBid(t, bidInfo));
+      console.log(`[Webhook] Found ${allTriggers.length} relevant triggers after filtering (vs checking all triggers)`);
+
+      // OPTIMIZATION: Only get users whose state preferences match the bid's origin state
+      usersWithStatePrefs = statePreferenceUsers.filter(u => statePreferenceUserMatchesBid(u, bidInfo));
+      console.log(`[Webhook] Found ${usersWithStatePrefs.length} state preference users after filtering (vs checking all users)`);
     } else {
-      // No bid number, get all state preference users (safe default)
-      usersWithStatePrefs = await sql`
-        SELECT DISTINCT
-          cnp.supabase_carrier_user_id as user_id,
-          cnp.state_preferences,
-          cnp.distance_threshold_miles,
-          cnp.similar_load_notifications
-        FROM carrier_notification_preferences cnp
-        WHERE cnp.supabase_carrier_user_id IS NOT NULL
-          AND cnp.similar_load_notifications = true
-          AND cnp.state_preferences IS NOT NULL
-          AND array_length(cnp.state_preferences, 1) > 0
-          AND NOT EXISTS (
-            SELECT 1 FROM notification_triggers nt
-            WHERE nt.supabase_carrier_user_id = cnp.supabase_carrier_user_id
-              AND nt.trigger_type = 'similar_load'
-              AND nt.is_active = true
-          )
-      `;
+      // Fallback: If we can't get bid info, check all triggers (safe default)
+      console.log(`[Webhook] Could not get bid info for ${bidNumber}, checking all triggers (safe fallback)`);
+      allTriggers = [...activeTriggers];
+      usersWithStatePrefs = statePreferenceUsers;
     }
 
     // Add virtual similar_load triggers for users with state preferences
@@ -153,13 +138,14 @@ export async function POST(request: NextRequest) {
         is_active: true,
       });
     }
-    
+
     // CRITICAL: Comprehensive matching - Check ALL carriers' preferences
     // This ensures every carrier is notified if the bid matches their preferences
-    if (bidNumber && bidInfo) {
+    if (bidInfo) {
       console.log(`[Webhook] Starting comprehensive carrier matching for bid ${bidNumber}...`);
-      
-      // 1. Check ALL carriers with favorites that match (exact, state, backhaul)
+
+      // 1. Check ALL carriers with favorites that match (exact, state, backhaul).
+      // This compares favorites with this bid's route, so it stays per bid.
       const favoriteMatches = await findCarriersWithMatchingFavorites({
         bidNumber,
         origin: bidInfo.origin || '',
@@ -169,25 +155,25 @@ export async function POST(request: NextRequest) {
         distance: bidInfo.distance,
         tag: bidInfo.tag,
       });
-      
+
       console.log(`[Webhook] Found ${favoriteMatches.length} carriers with matching favorites`);
-      
+
       // Add virtual triggers for all favorite matches
       for (const match of favoriteMatches) {
         const userId = match.userId;
-        
+
         // Check if user already has this type of trigger (avoid duplicates)
-        const alreadyHasTrigger = allTriggers.some(t => 
-          t.supabase_carrier_user_id === userId && 
+        const alreadyHasTrigger = allTriggers.some(t =>
+          t.supabase_carrier_user_id === userId &&
           t.trigger_type === match.matchType &&
           t.trigger_config?.favoriteBidNumber === match.favoriteBidNumber
         );
-        
+
         if (!alreadyHasTrigger) {
           console.log(`[Webhook] Adding virtual ${match.triggerType} trigger for user ${userId} (favorite: ${match.favoriteBidNumber}, match: ${match.matchType})`);
           allTriggers.push({
-            id: match.matchType === 'exact_match' ? -3 : 
-                match.matchType === 'state_match' ? -4 : 
+            id: match.matchType === 'exact_match' ? -3 :
+                match.matchType === 'state_match' ? -4 :
                 match.matchType === 'backhaul' ? -5 : -2,
             supabase_carrier_user_id: userId,
             trigger_type: match.triggerType, // Use the triggerType from the match (exact_match or similar_load)
@@ -196,29 +182,22 @@ export async function POST(request: NextRequest) {
           });
         }
       }
-      
+
       // 2. Check ALL carriers who have this exact bid in favorites (favorite_available)
-      const carriersWithExactFavorite = await sql`
-        SELECT DISTINCT
-          cf.supabase_carrier_user_id as user_id,
-          cf.bid_number
-        FROM carrier_favorites cf
-        WHERE cf.bid_number = ${bidNumber}
-          AND cf.supabase_carrier_user_id IS NOT NULL
-      `;
-      
+      const carriersWithExactFavorite = exactFavorites.filter((f: any) => String(f.bid_number) === bidNumber);
+
       console.log(`[Webhook] Found ${carriersWithExactFavorite.length} carrier(s) with bid ${bidNumber} as exact favorite`);
-      
+
       // Add virtual favorite_available triggers
       for (const favorite of carriersWithExactFavorite) {
         const userId = favorite.user_id;
-        
+
         // Check if user already has a favorite_available trigger
-        const alreadyHasTrigger = allTriggers.some(t => 
-          t.supabase_carrier_user_id === userId && 
+        const alreadyHasTrigger = allTriggers.some(t =>
+          t.supabase_carrier_user_id === userId &&
           t.trigger_type === 'favorite_available'
         );
-        
+
         if (!alreadyHasTrigger) {
           console.log(`[Webhook] Adding virtual favorite_available trigger for user ${userId} (bid ${bidNumber} is favorited)`);
           allTriggers.push({
@@ -233,17 +212,139 @@ export async function POST(request: NextRequest) {
         }
       }
     }
+
+    triggersByBid.set(bidNumber, allTriggers);
+  }
+
+  return triggersByBid;
+}
+
+/**
+ * Webhook endpoint to trigger notification processing when a new bid is inserted
+ * This can be called from the Telegram bot forwarder or other services
+ * 
+ * Body: { bidNumber: "123" } for a single bid, or { bidNumbers: ["123", "456"] }
+ * for a burst coalesced by the forwarder. A burst enqueues one job per user.
+ * Outbox idempotency keys (idempotencyKey / idempotencyKeys) are deduplicated per
+ * (user, key), so a retried bid is not enqueued again whatever burst it comes in.
+ * 
+ * Security: Uses a simple API key check (set WEBHOOK_API_KEY env var)
+ */
+export async function POST(request: NextRequest) {
+  try {
+    // Check webhook API key for security
+    const apiKey = request.headers.get('x-webhook-key') || request.headers.get('authorization')?.replace('Bearer ', '');
+    const expectedKey = process.env.WEBHOOK_API_KEY;
+    
+    if (expectedKey && apiKey !== expectedKey) {
+      return NextResponse.json(
+        { error: 'Unauthorized' },
+        { status: 401 }
+      );
+    }
+
+    const body = await request.json().catch(() => ({}));
+    const rawBidNumbers: unknown[] = Array.isArray(body.bidNumbers) ? body.bidNumbers : body.bidNumber ? [body.bidNumber] : [];
+
+    // Idempotency keys come from the forwarder's notification outbox, one per bid and in
+    // the same order. A retried bid may arrive in a different burst than the first time,
+    // so besides the per-request job ID each (user, key) is only enqueued once.
+    const idempotencyKeys: unknown[] = Array.isArray(body.idempotencyKeys) ? body.idempotencyKeys : body.idempotencyKey ? [body.idempotencyKey] : [];
+    const keyByBid = new Map<string, string>();
+    rawBidNumbers.forEach((b, i) => {
+      const key = idempotencyKeys[i];
+      if (b !== null && b !== undefined && b !== '' && key !== null && key !== undefined && key !== '') {
+        keyByBid.set(String(b), String(key));
+      }
+    });
+
+    const bidNumbers: string[] = Array.from(new Set<string>(
+      rawBidNumbers
+        .filter((b: unknown) => b !== null && b !== undefined && b !== '')
+        .map((b: unknown) => String(b))
+    ));
+
+    console.log(`[Webhook] New bid notification trigger for bid ${bidNumbers.length ? bidNumbers.join(', ') : 'all'}`);
+
+    let allTriggers: any[] = [];
+    
+    if (bidNumbers.length > 0) {
+      for (const [bidNumber, triggers] of await collectTriggersForBids(bidNumbers)) {
+        const idempotencyKey = keyByBid.get(bidNumber) ?? null;
+        for (const trigger of triggers) {
+          allTriggers.push({ ...trigger, idempotencyKey });
+        }
+      }
+    } else {
+      // No bid number provided, check all triggers (safe default)
+      console.log(`[Webhook] No bid number provided, checking all triggers (safe fallback)`);
+      allTriggers = await getAllActiveTriggers();
+
+      for (const userPref of await getAllStatePreferenceUsers()) {
+        allTriggers.push({
+          id: -1, // Virtual trigger ID
+          supabase_carrier_user_id: userPref.user_id,
+          trigger_type: 'similar_load',
+          trigger_config: {
+            statePreferences: userPref.state_preferences,
+            distanceThreshold: userPref.distance_threshold_miles || 50,
+          },
+          is_active: true,
+        });
+      }
+    }
     
     console.log(`[Webhook] Total triggers after adding virtual triggers: ${allTriggers.length}`);
 
-    // Group triggers by user to batch process
+    // Drop the triggers of bids already enqueued for a user (a retried outbox key)
+    const userKeys = new Map<string, string[]>();
+    for (const trigger of allTriggers) {
+      if (!trigger.idempotencyKey) continue;
+      const keys = userKeys.get(trigger.supabase_carrier_user_id) ?? [];
+      if (!keys.includes(trigger.idempotencyKey)) keys.push(trigger.idempotencyKey);
+      userKeys.set(trigger.supabase_carrier_user_id, keys);
+    }
+    const freshKeys = new Map<string, Set<string>>();
+    for (const [userId, keys] of userKeys) {
+      keys.sort();
+      freshKeys.set(userId, await claimIdempotencyKeys(userId, keys));
+    }
+    const duplicateTriggers = allTriggers.filter(t =>
+      t.idempotencyKey && !freshKeys.get(t.supabase_carrier_user_id)?.has(t.idempotencyKey)
+    ).length;
+    if (duplicateTriggers > 0) {
+      console.log(`[Webhook] Skipping ${duplicateTriggers} triggers of bids already enqueued for their user`);
+    }
+
+    // Group triggers by user to batch process. Bids in the same burst often
+    // share triggers, so drop exact duplicates and merge favorite_available
+    // bid lists instead of enqueueing them twice.
     const userTriggers = new Map<string, any[]>();
+    const seenTriggers = new Set<string>();
     for (const trigger of allTriggers) {
       const userId = trigger.supabase_carrier_user_id;
+      if (trigger.idempotencyKey && !freshKeys.get(userId)?.has(trigger.idempotencyKey)) continue;
       if (!userTriggers.has(userId)) {
         userTriggers.set(userId, []);
       }
-      userTriggers.get(userId)!.push(trigger);
+      const triggers = userTriggers.get(userId)!;
+
+      if (trigger.trigger_type === 'favorite_available' && trigger.id === -2) {
+        const existing = triggers.find(t => t.trigger_type === 'favorite_available' && t.id === -2);
+        if (existing) {
+          const merged = new Set<string>([
+            ...(existing.trigger_config?.favoriteBidNumbers || []),
+            ...(trigger.trigger_config?.favoriteBidNumbers || []),
+          ]);
+          existing.trigger_config = { ...existing.trigger_config, favoriteBidNumbers: Array.from(merged) };
+          continue;
+        }
+      }
+
+      const key = `${userId}:${trigger.id}:${trigger.trigger_type}:${JSON.stringify(trigger.trigger_config ?? null)}`;
+      if (seenTriggers.has(key)) continue;
+      seenTriggers.add(key);
+      triggers.push(trigger);
     }
 
     let enqueuedCount = 0;
@@ -268,17 +369,27 @@ export async function POST(request: NextRequest) {
       
       console.log(`[Webhook] Enqueueing job for user ${userId} with ${triggers.length} triggers: ${triggers.map(t => t.trigger_type).join(', ')}`);
       
-      await queue.add(
-        `process-user-${userId}`,
-        {
-          userId,
-          triggers: triggerData,
-        },
-        {
-          priority: hasUrgent ? 10 : 5,
-          jobId: `user-${userId}-${Date.now()}`, // Unique job ID
-        }
-      );
+      const keys = userKeys.get(userId) ?? [];
+      try {
+        await queue.add(
+          `process-user-${userId}`,
+          {
+            userId,
+            triggers: triggerData,
+          },
+          {
+            priority: hasUrgent ? 10 : 5,
+            // Unique job ID; stable for a redelivered outbox call (sorted keys of this request)
+            jobId: keys.length > 0
+              ? `user-${userId}-${createHash('sha1').update(keys.join('|')).digest('hex').slice(0, 16)}`
+              : `user-${userId}-${Date.now()}`,
+          }
+        );
+      } catch (error) {
+        // Not enqueued: let the outbox retry find these keys unclaimed
+        await releaseIdempotencyKeys(userId, Array.from(freshKeys.get(userId) ?? []));
+        throw error;
+      }
 
       enqueuedCount++;
     }
@@ -290,7 +401,8 @@ export async function POST(request: NextRequest) {
       message: `Enqueued ${enqueuedCount} notification jobs`,
       usersProcessed: enqueuedCount,
       totalTriggers: allTriggers.length,
-      bidNumber: bidNumber || null,
+      bidNumber: bidNumbers[0] || null,
+      bidNumbers,
     });
 
   } catch (error: any) {
@@ -0,0 +1,33 @@
+-- Migration 121: Notification outbox for the Telegram bid forwarder
+-- Description: The forwarder writes one pending row per upserted bid in the same
+--              transaction as the telegram_bids upsert. A background dispatcher
+--              delivers rows to /api/webhooks/new-bid with retries, so a failed
+--              webhook call no longer drops the carrier notification.
+
+CREATE TABLE IF NOT EXISTS public.telegram_bid_notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    bid_number TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'delivered', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    delivered_at TIMESTAMP WITH TIME ZONE,
+    CONSTRAINT telegram_bid_notification_outbox_key UNIQUE (idempotency_key)
+);
+
+-- Dispatcher scans only due pending rows
+CREATE INDEX IF NOT EXISTS idx_telegram_bid_outbox_due
+    ON public.telegram_bid_notification_outbox(next_attempt_at, id)
+    WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_telegram_bid_outbox_bid_number
+    ON public.telegram_bid_notification_outbox(bid_number);
+CREATE INDEX IF NOT EXISTS idx_telegram_bid_outbox_delivered_at
+    ON public.telegram_bid_notification_outbox(delivered_at)
+    WHERE status = 'delivered';
+
+COMMENT ON TABLE public.telegram_bid_notification_outbox IS 'Pending new-bid notification calls written by the Telegram forwarder in the same transaction as the bid upsert. Delivered rows are pruned by the forwarder after OUTBOX_RETENTION_DAYS.';
+COMMENT ON COLUMN public.telegram_bid_notification_outbox.idempotency_key IS 'bid_number:received_at of the upsert that produced the row; passed to the webhook so redeliveries do not enqueue duplicate jobs';
+COMMENT ON COLUMN public.telegram_bid_notification_outbox.next_attempt_at IS 'When the row is next due. Claiming a row pushes this forward as a lease; failures push it out with exponential backoff.';
+COMMENT ON COLUMN public.telegram_bid_notification_outbox.status IS 'pending = waiting for delivery, delivered = webhook returned 200, failed = gave up after OUTBOX_MAX_ATTEMPTS';
@@ -4,8 +4,9 @@ Debug script to test bid parsing with the exact text provided
 """
 
 import re
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from typing import Optional, Dict, List
+from zoneinfo import ZoneInfo
 
 # Copy the regex patterns from the forwarder
 RX_BID     = re.compile(r"^\s*New\s+Load\s+Bid:\s*(?P<bid>\d+)\s*$", re.I | re.M)
@@ -15,8 +16,15 @@ RX_DELIV   = re.compile(r"^\s*Delivery:\s*(?P<deliv>.+?)\s*$", re.I | re.M)
 RX_TAG     = re.compile(r"^\s*#(?P<tag>[A-Za-z0-9_-]+)\s*$", re.I | re.M)
 RX_STOP    = re.compile(r"^\s*Stop\s*\d+:\s*(?P<place>.+?)\s*$", re.I | re.M)
 
+# Same zone handling as the forwarder (DST-aware America/Chicago)
+CENTRAL_TZ = ZoneInfo("America/Chicago")
+
+def to_central(naive: datetime) -> datetime:
+    """Attach America/Chicago to a wall-clock time (skipped-hour times move past the gap)."""
+    return naive.replace(tzinfo=CENTRAL_TZ).astimezone(timezone.utc).astimezone(CENTRAL_TZ)
+
 def parse_datetime_string(dt_str: str) -> Optional[datetime]:
-    """Parse datetime string in various formats and return in CST timezone."""
+    """Parse datetime string in various formats and return it in America/Chicago."""
     if not dt_str:
         return None
     
@@ -42,9 +50,8 @@ def parse_datetime_string(dt_str: str) -> Optional[datetime]:
             if fmt.endswith("%Y") and not any(x in fmt for x in ["%H", "%I"]):
                 parsed_dt = parsed_dt.replace(hour=9, minute=0, second=0)
             
-            # Return the datetime in CST timezone
-            # Assume the input time is already in CST and store it as such
-            return parsed_dt.replace(tzinfo=timezone(timedelta(hours=-6)))  # CST is UTC-6
+            # The input time is Central local time (CST or CDT depending on the date)
+            return to_central(parsed_dt)
             
         except ValueError:
             continue
@@ -67,9 +74,8 @@ def parse_datetime_string(dt_str: str) -> Optional[datetime]:
             elif ampm and ampm.upper() == 'AM' and hour == 12:
                 hour = 0
             
-            # Create datetime in CST timezone
-            dt = datetime(year, month, day, hour, minute, 0)
-            return dt.replace(tzinfo=timezone(timedelta(hours=-6)))  # CST is UTC-6
+            # Create datetime in Central local time
+            return to_central(datetime(year, month, day, hour, minute, 0))
     except Exception:
         pass
     
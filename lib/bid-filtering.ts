@@ -40,17 +40,19 @@ export function extractStateFromStop(stop: string): string | null {
   return null;
 }
 
-/**
- * Get bid information for filtering
- */
-export async function getBidInfoForFiltering(bidNumber: string): Promise<{
+export type BidFilteringInfo = {
   originState: string | null;
   destinationState: string | null;
   origin: string | null;
   destination: string | null;
   distance: number | null;
   tag: string | null;
-} | null> {
+};
+
+/**
+ * Get bid information for filtering
+ */
+export async function getBidInfoForFiltering(bidNumber: string): Promise<BidFilteringInfo | null> {
   try {
     const bidResult = await sql`
       SELECT 
@@ -66,43 +68,71 @@ export async function getBidInfoForFiltering(bidNumber: string): Promise<{
       return null;
     }
     
-    const bid = bidResult[0];
-    
-    // Parse stops
-    let stopsArray: string[] = [];
-    if (bid.stops) {
-      if (Array.isArray(bid.stops)) {
-        stopsArray = bid.stops;
-      } else if (typeof bid.stops === 'string') {
-        try {
-          const parsed = JSON.parse(bid.stops);
-          stopsArray = Array.isArray(parsed) ? parsed : [parsed];
-        } catch {
-          stopsArray = [bid.stops];
-        }
-      }
-    }
-    
-    const origin = stopsArray.length > 0 ? stopsArray[0] : null;
-    const destination = stopsArray.length > 0 ? stopsArray[stopsArray.length - 1] : null;
-    
-    const originState = origin ? extractStateFromStop(origin) : null;
-    const destinationState = destination ? extractStateFromStop(destination) : null;
-    
-    return {
-      originState,
-      destinationState,
-      origin,
-      destination,
-      distance: bid.distance_miles ? parseFloat(bid.distance_miles) : null,
-      tag: bid.tag || null,
-    };
+    return bidInfoFromRow(bidResult[0]);
   } catch (error) {
     console.error(`[BidFiltering] Error getting bid info for ${bidNumber}:`, error);
     return null;
   }
 }
 
+/**
+ * Get bid information for filtering for several bids in one query
+ * (bids that are missing or fail to load are left out of the map)
+ */
+export async function getBidInfosForFiltering(bidNumbers: string[]): Promise<Map<string, BidFilteringInfo>> {
+  const infos = new Map<string, BidFilteringInfo>();
+  if (bidNumbers.length === 0) return infos;
+  try {
+    const rows = await sql`
+      SELECT 
+        bid_number,
+        stops,
+        distance_miles,
+        tag
+      FROM telegram_bids
+      WHERE bid_number = ANY(${bidNumbers})
+    `;
+    for (const row of rows) {
+      infos.set(String(row.bid_number), bidInfoFromRow(row));
+    }
+  } catch (error) {
+    console.error(`[BidFiltering] Error getting bid info for ${bidNumbers.length} bids:`, error);
+  }
+  return infos;
+}
+
+function bidInfoFromRow(bid: any): BidFilteringInfo {
+  // Parse stops
+  let stopsArray: string[] = [];
+  if (bid.stops) {
+    if (Array.isArray(bid.stops)) {
+      stopsArray = bid.stops;
+    } else if (typeof bid.stops === 'string') {
+      try {
+        const parsed = JSON.parse(bid.stops);
+        stopsArray = Array.isArray(parsed) ? parsed : [parsed];
+      } catch {
+        stopsArray = [bid.stops];
+      }
+    }
+  }
+  
+  const origin = stopsArray.length > 0 ? stopsArray[0] : null;
+  const destination = stopsArray.length > 0 ? stopsArray[stopsArray.length - 1] : null;
+  
+  const originState = origin ? extractStateFromStop(origin) : null;
+  const destinationState = destination ? extractStateFromStop(destination) : null;
+  
+  return {
+    originState,
+    destinationState,
+    origin,
+    destination,
+    distance: bid.distance_miles ? parseFloat(bid.distance_miles) : null,
+    tag: bid.tag || null,
+  };
+}
+
 /**
  * Filter triggers that could potentially match a new bid
  * This dramatically reduces the number of jobs enqueued
@@ -318,3 +348,53 @@ export async function filterRelevantStatePreferenceUsers(
   return relevantUsers;
 }
 
+
+/**
+ * In-memory form of filterRelevantTriggers, for a burst of bids matched against
+ * triggers loaded once (getAllActiveTriggers) instead of querying per bid
+ */
+export function triggerCouldMatchBid(trigger: any, bidInfo: BidFilteringInfo): boolean {
+  const { originState, destinationState, origin, destination, tag } = bidInfo;
+
+  // Same safe fallback as the query: no route info, every trigger is relevant
+  if (!originState && !destinationState && !origin && !destination) return true;
+
+  const config = parseTriggerConfig(trigger.trigger_config);
+  switch (trigger.trigger_type) {
+    case 'similar_load':
+      return !!originState && Array.isArray(config.statePreferences) &&
+        config.statePreferences.map(String).includes(originState);
+    case 'exact_match': {
+      if (!origin || !destination) return false;
+      const stops = config.favoriteStops;
+      const stopsText = stops === null || stops === undefined ? null
+        : typeof stops === 'string' ? stops : JSON.stringify(stops);
+      return (stopsText !== null && (stopsText.includes(origin) || stopsText.includes(destination))) ||
+        (config.favoriteBidNumber !== null && config.favoriteBidNumber !== undefined) ||
+        (!!tag && config.favoriteTag === tag);
+    }
+    default:
+      // deadline_approaching and the other types are always checked
+      return true;
+  }
+}
+
+/**
+ * In-memory form of filterRelevantStatePreferenceUsers, for users loaded once
+ * (getAllStatePreferenceUsers)
+ */
+export function statePreferenceUserMatchesBid(user: any, bidInfo: { originState: string | null }): boolean {
+  if (!bidInfo.originState) return true;
+  return Array.isArray(user.state_preferences) && user.state_preferences.includes(bidInfo.originState);
+}
+
+function parseTriggerConfig(config: any): any {
+  if (typeof config === 'string') {
+    try {
+      return JSON.parse(config) || {};
+    } catch {
+      return {};
+    }
+  }
+  return config || {};
+}
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Benchmark + regression check for the bid parser in telegram_bot_forwarder.py.
+
+Loads a corpus of channel posts (JSONL: one {"name", "text"} object per line,
+optionally with "expect": the fields parse_bid must return, or false for
+posts that must not parse as a bid) and:
+  - asserts field-level equivalence of parse_bid vs parse_bid_regex and of
+    parse_datetime_string vs parse_datetime_string_strptime on every post
+  - checks "expect" entries (datetimes as ISO strings, offset included)
+  - measures throughput (msgs/s), p50/p99 latency and allocations per message
+
+Exits 1 on any mismatch, so it can gate parser changes:
+  python3 scripts/bench_bid_parser.py --check
+  python3 scripts/bench_bid_parser.py --iterations 2000
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import telegram_bot_forwarder as fwd  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(HERE, "..", "bench", "bid_posts.jsonl")
+BID_FIELDS = ("bid", "miles", "pickup_dt", "delivery_dt", "pickup_timestamp",
+              "delivery_timestamp", "stops", "tag")
+
+
+def load_corpus(paths: List[str]) -> List[Dict[str, Any]]:
+    """Read JSONL posts. Raw Telegram update JSON ({"channel_post": {"text"}}) is accepted too."""
+    posts: List[Dict[str, Any]] = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                obj = json.loads(line)
+                text = obj.get("text")
+                if text is None:
+                    msg = obj.get("channel_post") or obj.get("message") or obj.get("edited_channel_post") or {}
+                    text = msg.get("text") or msg.get("caption") or ""
+                posts.append({
+                    "name": obj.get("name") or f"{os.path.basename(path)}:{n}",
+                    "text": text,
+                    "expect": obj.get("expect"),
+                })
+    return posts
+
+
+def _norm(v: Any) -> Any:
+    """Comparable form of a field: datetimes keep their offset, not just the instant."""
+    if hasattr(v, "utcoffset") and hasattr(v, "isoformat"):
+        return v.isoformat()
+    return v
+
+
+def diff_fields(a: Optional[Dict], b: Optional[Dict]) -> List[str]:
+    if a is None or b is None:
+        return [] if a is b else [f"result: {a!r} != {b!r}"]
+    out = []
+    for k in sorted(set(a) | set(b)):
+        va, vb = _norm(a.get(k)), _norm(b.get(k))
+        if va != vb:
+            out.append(f"{k}: {va!r} != {vb!r}")
+    return out
+
+
+def check_corpus(posts: List[Dict[str, Any]]) -> int:
+    failures = 0
+    for p in posts:
+        text = p["text"]
+        problems = [f"parse_bid vs parse_bid_regex {d}"
+                    for d in diff_fields(fwd.parse_bid(text), fwd.parse_bid_regex(text))]
+
+        got = fwd.parse_bid(text)
+        if got is not None and set(got) != set(BID_FIELDS):
+            problems.append(f"fields {sorted(got)} != {sorted(BID_FIELDS)}")
+        for key in ("pickup_dt", "delivery_dt"):
+            raw = got.get(key) if got else None
+            if raw:
+                fast, ref = _norm(fwd.parse_datetime_string(raw)), _norm(fwd.parse_datetime_string_strptime(raw))
+                if fast != ref:
+                    problems.append(f"parse_datetime_string({raw!r}): {fast!r} != {ref!r}")
+
+        expect = p.get("expect")
+        if expect is False:
+            if got is not None:
+                problems.append(f"expect no bid, got {got!r}")
+        elif expect:
+            if got is None:
+                problems.append("expect a bid, got None")
+            else:
+                for k, v in expect.items():
+                    g = _norm(got.get(k)) if got else None
+                    if g != v:
+                        problems.append(f"expect {k}: got {g!r}, want {v!r}")
+
+        if problems:
+            failures += 1
+            print(f"FAIL {p['name']}")
+            for line in problems:
+                print(f"    {line}")
+    return failures
+
+
+def _percentile(sorted_ns: List[int], q: float) -> float:
+    if not sorted_ns:
+        return 0.0
+    i = min(len(sorted_ns) - 1, int(round(q * (len(sorted_ns) - 1))))
+    return sorted_ns[i] / 1000.0
+
+
+def bench(label: str, fn: Callable[[Any], Any], inputs: List[Any], iterations: int,
+          before_each: Optional[Callable[[], None]] = None) -> None:
+    """Time fn over inputs `iterations` times, then measure allocations in a separate pass."""
+    lat: List[int] = []
+    gc.disable()
+    try:
+        t_start = time.perf_counter_ns()
+        for _ in range(iterations):
+            for x in inputs:
+                if before_each:
+                    before_each()
+                t0 = time.perf_counter_ns()
+                fn(x)
+                lat.append(time.perf_counter_ns() - t0)
+        wall = (time.perf_counter_ns() - t_start) / 1e9
+    finally:
+        gc.enable()
+    lat.sort()
+
+    # Allocation pass: tracemalloc slows everything down, so it is kept out of the timings
+    tracemalloc.start()
+    peak_total = 0
+    for x in inputs:
+        if before_each:
+            before_each()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(x)
+        peak_total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    n = len(lat)
+    print(f"{label:<34} {n / wall:>11,.0f} msg/s   p50 {_percentile(lat, 0.50):>7.1f}us"
+          f"   p99 {_percentile(lat, 0.99):>7.1f}us   {peak_total / max(1, len(inputs)):>8,.0f} B/msg peak")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Bid parser benchmark and regression corpus check")
+    ap.add_argument("--corpus", action="append",
+                    help="JSONL corpus file (repeatable; default: bench/bid_posts.jsonl)")
+    ap.add_argument("--iterations", type=int, default=500, help="passes over the corpus per benchmark")
+    ap.add_argument("--check", action="store_true", help="equivalence/expectation checks only, no timing")
+    args = ap.parse_args()
+
+    posts = load_corpus(args.corpus or [DEFAULT_CORPUS])
+    failures = check_corpus(posts)
+    print(f"{len(posts)} posts checked, {failures} failing")
+    if failures or args.check:
+        return 1 if failures else 0
+
+    texts = [p["text"] for p in posts]
+    dt_strings = []
+    for p in posts:
+        d = fwd.parse_bid(p["text"])
+        if d:
+            dt_strings += [s for s in (d["pickup_dt"], d["delivery_dt"]) if s]
+
+    print(f"\n{len(texts)} posts, {len(dt_strings)} datetime strings, {args.iterations} iterations")
+    bench("parse_bid", fwd.parse_bid, texts, args.iterations)
+    bench("parse_bid_regex (reference)", fwd.parse_bid_regex, texts, args.iterations)
+    bench("parse_bid (cold datetime cache)", fwd.parse_bid, texts, args.iterations,
+          before_each=fwd._parse_datetime_cached.cache_clear)
+    bench("parse_datetime_string", fwd.parse_datetime_string, dt_strings, args.iterations)
+    bench("parse_datetime_string (cold)", fwd.parse_datetime_string, dt_strings, args.iterations,
+          before_each=fwd._parse_datetime_cached.cache_clear)
+    bench("parse_datetime_string_strptime", fwd.parse_datetime_string_strptime, dt_strings, args.iterations)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# scripts/forward_scheduler.py
+# Rate-limited, order-preserving send queue shared by the Telegram forwarders
+# (telegram_bot_forwarder.py and the Telethon telegram_forwarder.py).
+#
+# Telegram allows a bot about one message per second and 20 per minute in a
+# group, and about 30 per second overall. Sends over that come back as
+# RetryAfter / FloodWaitError. Instead of sending from the update handler, the
+# forwarders submit posts here:
+#   - one FIFO per target chat, so posts reach each chat in source order
+#   - a per-chat token bucket (plus a min spacing) and a global token bucket
+#   - a failed send is asked about via retry_delay(exc, attempt): a delay puts
+#     the post back at the head of its chat's queue (a flood wait pauses that
+#     chat for the whole delay), None gives up on it
+#   - a post that is still queued is coalesced with later submits/edits of the
+#     same key (the newest payload is sent, once)
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+log = logging.getLogger("forward_scheduler")
+
+class TokenBucket:
+    """Classic token bucket; callers ask how long until a token and then take it."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+class _Pending:
+    __slots__ = ("key", "payload", "waiters", "attempts")
+
+    def __init__(self, key: Hashable, payload: Any, waiter: "asyncio.Future[bool]"):
+        self.key = key
+        self.payload = payload
+        self.waiters: List["asyncio.Future[bool]"] = [waiter]
+        self.attempts = 0
+
+    def resolve(self, sent: bool = False, error: Optional[BaseException] = None) -> None:
+        for w in self.waiters:
+            if w.done():
+                continue
+            if error is not None:
+                w.set_exception(error)
+            else:
+                w.set_result(sent)
+
+class _ChatQueue:
+    __slots__ = ("chat_id", "pending", "bucket", "last_sent", "paused_until", "wake", "task", "in_flight")
+
+    def __init__(self, chat_id: Any, bucket: TokenBucket):
+        self.chat_id = chat_id
+        self.pending: "OrderedDict[Hashable, _Pending]" = OrderedDict()
+        self.bucket = bucket
+        self.last_sent = 0.0
+        self.paused_until = 0.0
+        self.wake = asyncio.Event()
+        self.task: Optional["asyncio.Task[None]"] = None
+        self.in_flight: Optional[_Pending] = None
+
+class ForwardScheduler:
+    """Per-chat ordered send queues under Telegram's flood limits.
+
+    send(chat_id, payload) performs one send and raises on failure;
+    retry_delay(exc, attempt) returns seconds to wait before retrying the same
+    post, or None to drop it. submit() returns a future that resolves True
+    once the post is sent, or raises the final error if it was dropped.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Any, Any], Awaitable[Any]],
+        retry_delay: Callable[[BaseException, int], Optional[float]],
+        *,
+        chat_per_minute: float = 20.0,
+        chat_burst: int = 5,
+        chat_min_interval: float = 1.0,
+        global_per_second: float = 30.0,
+        on_backlog: Optional[Callable[[int], None]] = None,
+    ):
+        self._send = send
+        self._retry_delay = retry_delay
+        self._chat_rate = chat_per_minute / 60.0
+        self._chat_burst = chat_burst
+        self._chat_min_interval = chat_min_interval
+        self._global = TokenBucket(global_per_second, global_per_second)
+        self._on_backlog = on_backlog
+        self._chats: Dict[Any, _ChatQueue] = {}
+        self._running = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    # ---- submit side ----
+    @property
+    def backlog(self) -> int:
+        """Posts queued or in flight, across all chats."""
+        return sum(len(q.pending) + (q.in_flight is not None) for q in self._chats.values())
+
+    def _changed(self) -> None:
+        backlog = self.backlog
+        if backlog:
+            self._idle.clear()
+        else:
+            self._idle.set()
+        if self._on_backlog is not None:
+            self._on_backlog(backlog)
+
+    def _queue(self, chat_id: Any) -> _ChatQueue:
+        q = self._chats.get(chat_id)
+        if q is None:
+            q = self._chats[chat_id] = _ChatQueue(chat_id, TokenBucket(self._chat_rate, self._chat_burst))
+        if self._running and (q.task is None or q.task.done()):
+            q.task = asyncio.create_task(self._worker(q), name=f"forward-{chat_id}")
+        return q
+
+    def submit(self, chat_id: Any, key: Hashable, payload: Any) -> "asyncio.Future[bool]":
+        """Queue payload for chat_id; a still-queued post with the same key is replaced in place."""
+        q = self._queue(chat_id)
+        waiter: "asyncio.Future[bool]" = asyncio.get_running_loop().create_future()
+        entry = q.pending.get(key)
+        if entry is not None:
+            entry.payload = payload
+            entry.waiters.append(waiter)
+        else:
+            q.pending[key] = _Pending(key, payload, waiter)
+            q.wake.set()
+        self._changed()
+        return waiter
+
+    def update(self, chat_id: Any, key: Hashable, payload: Any) -> bool:
+        """Replace the payload of a still-queued post; False if it is not queued (already sent or never seen)."""
+        q = self._chats.get(chat_id)
+        entry = q.pending.get(key) if q is not None else None
+        if entry is None:
+            return False
+        entry.payload = payload
+        return True
+
+    # ---- send side ----
+    async def _worker(self, q: _ChatQueue) -> None:
+        while True:
+            if not q.pending:
+                q.wake.clear()
+                await q.wake.wait()
+                continue
+            now = time.monotonic()
+            wait = max(q.paused_until - now,
+                       q.last_sent + self._chat_min_interval - now,
+                       q.bucket.delay(now),
+                       self._global.delay(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            now = time.monotonic()
+            q.bucket.take(now)
+            self._global.take(now)
+            q.last_sent = now
+
+            # Popped before sending: an edit that arrives mid-send is a new post
+            _, entry = q.pending.popitem(last=False)
+            q.in_flight = entry
+            entry.attempts += 1
+            try:
+                await self._send(q.chat_id, entry.payload)
+            except asyncio.CancelledError:
+                self._requeue_head(q, entry)
+                q.in_flight = None
+                raise
+            except Exception as e:
+                q.in_flight = None
+                delay = self._retry_delay(e, entry.attempts)
+                if delay is None:
+                    entry.resolve(error=e)
+                else:
+                    # Back at the head: nothing behind it in this chat goes first
+                    q.paused_until = max(q.paused_until, time.monotonic() + delay)
+                    self._requeue_head(q, entry)
+            else:
+                q.in_flight = None
+                entry.resolve(sent=True)
+            self._changed()
+
+    @staticmethod
+    def _requeue_head(q: _ChatQueue, entry: _Pending) -> None:
+        newer = q.pending.pop(entry.key, None)
+        if newer is not None:
+            # Edited while in flight: retry with the newest payload, answer both waiters
+            entry.payload = newer.payload
+            entry.waiters.extend(newer.waiters)
+        q.pending[entry.key] = entry
+        q.pending.move_to_end(entry.key, last=False)
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        self._running = True
+        for chat_id, q in self._chats.items():
+            if q.pending:
+                self._queue(chat_id)
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> int:
+        """Give the backlog up to `timeout` seconds to drain, then cancel. Returns posts left unsent."""
+        if self.backlog and timeout:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._running = False
+        tasks = [q.task for q in self._chats.values() if q.task is not None]
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
+            try:
+                await t
+            except (asyncio.CancelledError, Exception):
+                pass
+        left = 0
+        for q in self._chats.values():
+            q.task = None
+            for entry in q.pending.values():
+                left += 1
+                entry.resolve(sent=False)
+            q.pending.clear()
+        if left:
+            log.warning("Forward scheduler stopped with %d posts unsent", left)
+        self._changed()
+        return left
@@ -4,6 +4,7 @@ const http = require('http');
 const cors = require('cors');
 const { spawn } = require('child_process');
 const path = require('path');
+const crypto = require('crypto');
 require('dotenv').config();
 
 // Log startup info
@@ -33,6 +34,18 @@ const wss = new WebSocket.Server({
 const clients = new Set();
 let telegramProcess = null;
 
+// Latest status from the forwarder's NDJSON stream (FORWARDER_UI=json)
+const idleStatus = {
+  connected: false,
+  forwarded_count: 0,
+  parsed_count: 0,
+  last_bid_at: null,
+  last_error: null,
+  uptime: '0s',
+  status: 'stopped'
+};
+let forwarderStatus = { ...idleStatus };
+
 // WebSocket connection handling
 wss.on('connection', (ws, req) => {
   console.log('Client connected to telegram forwarder WebSocket');
@@ -41,15 +54,7 @@ wss.on('connection', (ws, req) => {
   // Send initial status
   ws.send(JSON.stringify({
     type: 'status',
-    data: {
-      connected: telegramProcess ? true : false,
-      forwarded_count: 0,
-      parsed_count: 0,
-      last_bid_at: null,
-      last_error: null,
-      uptime: '0s',
-      status: telegramProcess ? 'running' : 'stopped'
-    }
+    data: forwarderStatus
   }));
 
   ws.on('close', () => {
@@ -72,6 +77,63 @@ function broadcast(message) {
   });
 }
 
+// Handle one line of forwarder output. NDJSON status/log messages are
+// already in the WebSocket message shape; anything else (tracebacks,
+// preflight output) is wrapped as a log line.
+function handleForwarderLine(line, level) {
+  if (!line) return;
+
+  let message = null;
+  if (line[0] === '{') {
+    try {
+      message = JSON.parse(line);
+    } catch (e) {
+      message = null;
+    }
+  }
+
+  if (message && message.type === 'status' && message.data) {
+    forwarderStatus = { ...forwarderStatus, ...message.data };
+    broadcast({ type: 'status', data: forwarderStatus });
+    return;
+  }
+
+  if (message && message.type === 'log') {
+    console.log(`Telegram forwarder [${message.level || 'info'}]:`, message.message);
+    broadcast(message);
+    return;
+  }
+
+  if (level === 'error') {
+    console.error('Telegram forwarder error:', line);
+  } else {
+    console.log('Telegram forwarder:', line);
+  }
+  broadcast({
+    type: 'log',
+    level: level,
+    message: line
+  });
+}
+
+// Split a child stream into lines (chunks can hold several lines or half of one)
+function readLines(stream, level) {
+  let buffered = '';
+  stream.setEncoding('utf8');
+  stream.on('data', (chunk) => {
+    buffered += chunk;
+    let newline;
+    while ((newline = buffered.indexOf('\n')) !== -1) {
+      handleForwarderLine(buffered.slice(0, newline).trim(), level);
+      buffered = buffered.slice(newline + 1);
+    }
+  });
+  stream.on('end', () => {
+    handleForwarderLine(buffered.trim(), level);
+    buffered = '';
+  });
+}
+
 // Start telegram forwarder process
 function startTelegramForwarder() {
   if (telegramProcess) {
@@ -88,31 +150,15 @@ function startTelegramForwarder() {
     cwd: __dirname,
     env: { 
       ...process.env,
-      DATABASE_URL: process.env.DATABASE_URL
+      DATABASE_URL: process.env.DATABASE_URL,
+      // Structured status stream instead of the full-screen Rich UI
+      FORWARDER_UI: process.env.FORWARDER_UI || 'json'
     }
   });
 
-  telegramProcess.stdout.on('data', (data) => {
-    const message = data.toString().trim();
-    console.log('Telegram forwarder:', message);
-    
-    broadcast({
-      type: 'log',
-      level: 'info',
-      message: message
-    });
-  });
-
-  telegramProcess.stderr.on('data', (data) => {
-    const message = data.toString().trim();
-    console.error('Telegram forwarder error:', message);
-    
-    broadcast({
-      type: 'log',
-      level: 'error',
-      message: message
-    });
-  });
+  forwarderStatus = { ...idleStatus, status: 'running' };
+  readLines(telegramProcess.stdout, 'info');
+  readLines(telegramProcess.stderr, 'error');
 
   telegramProcess.on('close', (code) => {
     console.log(`Telegram forwarder process exited with code ${code}`);
@@ -124,32 +170,17 @@ function startTelegramForwarder() {
       message: `Process exited with code ${code}`
     });
 
+    forwarderStatus = { ...forwarderStatus, connected: false, status: 'stopped' };
     broadcast({
       type: 'status',
-      data: {
-        connected: false,
-        forwarded_count: 0,
-        parsed_count: 0,
-        last_bid_at: null,
-        last_error: null,
-        uptime: '0s',
-        status: 'stopped'
-      }
+      data: forwarderStatus
     });
   });
 
   // Send running status
   broadcast({
     type: 'status',
-    data: {
-      connected: true,
-      forwarded_count: 0,
-      parsed_count: 0,
-      last_bid_at: null,
-      last_error: null,
-      uptime: '0s',
-      status: 'running'
-    }
+    data: forwarderStatus
   });
 }
 
@@ -160,17 +191,10 @@ function stopTelegramForwarder() {
     telegramProcess.kill();
     telegramProcess = null;
     
+    forwarderStatus = { ...forwarderStatus, connected: false, status: 'stopped' };
     broadcast({
       type: 'status',
-      data: {
-        connected: false,
-        forwarded_count: 0,
-        parsed_count: 0,
-        last_bid_at: null,
-        last_error: null,
-        uptime: '0s',
-        status: 'stopped'
-      }
+      data: forwarderStatus
     });
   }
 }
@@ -192,6 +216,7 @@ app.get('/status', (req, res) => {
   console.log(`[STATUS] Status check requested from ${req.ip}`);
   res.json({ 
     status: telegramProcess ? 'running' : 'stopped',
+    forwarder: forwarderStatus,
     connected_clients: clients.size,
     port: process.env.PORT || 3001,
     host: process.env.HOST || '0.0.0.0',
@@ -199,6 +224,62 @@ app.get('/status', (req, res) => {
   });
 });
 
+// Prometheus metrics from the forwarder process (it listens on localhost only).
+// Public only with METRICS_TOKEN set; the scraper sends it as a bearer token.
+function metricsAuthorized(req) {
+  const expected = Buffer.from(`Bearer ${process.env.METRICS_TOKEN}`);
+  const given = Buffer.from(req.headers.authorization || '');
+  return given.length === expected.length && crypto.timingSafeEqual(given, expected);
+}
+
+app.get('/metrics', (req, res) => {
+  if (!process.env.METRICS_TOKEN) {
+    return res.status(404).type('text/plain').send('metrics are not exposed (set METRICS_TOKEN)\n');
+  }
+  if (!metricsAuthorized(req)) {
+    return res.status(401).set('WWW-Authenticate', 'Bearer realm="metrics"').type('text/plain').send('unauthorized\n');
+  }
+  const metricsPort = process.env.METRICS_PORT || 9464;
+  const upstream = http.get({ host: '127.0.0.1', port: metricsPort, path: '/metrics', headers: { accept: req.headers.accept || '*/*' } }, (upstreamRes) => {
+    res.status(upstreamRes.statusCode);
+    res.set('Content-Type', upstreamRes.headers['content-type'] || 'text/plain');
+    upstreamRes.pipe(res);
+  });
+  upstream.setTimeout(5000, () => upstream.destroy(new Error('timeout')));
+  upstream.on('error', (error) => {
+    if (!res.headersSent) {
+      res.status(503).type('text/plain').send(`forwarder metrics unavailable: ${error.message}\n`);
+    }
+  });
+});
+
+// Telegram update pushes (TELEGRAM_UPDATES=webhook); the forwarder checks the secret token
+app.post(process.env.TELEGRAM_WEBHOOK_PATH || '/telegram/webhook', (req, res) => {
+  const body = Buffer.from(JSON.stringify(req.body || {}));
+  const upstream = http.request({
+    host: '127.0.0.1',
+    port: process.env.TELEGRAM_WEBHOOK_PORT || 8081,
+    path: req.path,
+    method: 'POST',
+    headers: {
+      'content-type': 'application/json',
+      'content-length': body.length,
+      'x-telegram-bot-api-secret-token': req.headers['x-telegram-bot-api-secret-token'] || '',
+    },
+  }, (upstreamRes) => {
+    res.status(upstreamRes.statusCode);
+    upstreamRes.pipe(res);
+  });
+  upstream.setTimeout(10000, () => upstream.destroy(new Error('timeout')));
+  upstream.on('error', (error) => {
+    // Non-200 makes Telegram redeliver once the forwarder is back
+    if (!res.headersSent) {
+      res.status(503).type('text/plain').send(`forwarder receiver unavailable: ${error.message}\n`);
+    }
+  });
+  upstream.end(body);
+});
+
 app.post('/telegram-forwarder', (req, res) => {
   try {
     const { action } = req.body;
@@ -1,92 +1,462 @@
 #!/usr/bin/env python3
 """
-Simple HTTP proxy server for Highway API
+HTTP proxy server for Highway API
 Run this on the laptop where Python requests works
-Usage: python3 scripts/highway-proxy-server.py
+Usage: python3 scripts/highway-proxy-server.py [--host 0.0.0.0] [--port 5001]
+
+Async (ASGI) app served by uvicorn: lookups run concurrently on one event
+loop and share one keep-alive connection pool to Highway, so a burst of MC
+checks from the admin UI neither serializes nor opens a TLS connection each.
+
+Lookups are cached (see CarrierCache): fresh entries are answered locally,
+stale ones are answered at once and refreshed in the background, and 404s
+are remembered for a shorter time. ?refresh=1 bypasses the cache.
+Concurrent lookups of the same key share one upstream call (single-flight).
+POST /proxy/carriers/bulk looks up a list at once and streams NDJSON.
+
+Responses are {"status", "data"}: the upstream body is passed through as is,
+or cut down to ?fields=a,b.c, and compressed (br if brotli is installed, else
+gzip) for clients that accept it.
 """
 
-from flask import Flask, request, jsonify
-import requests
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
 import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import httpx
+import uvicorn
 from dotenv import load_dotenv
-from flask_cors import CORS
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
 
-load_dotenv('.env.local')
+try:
+    import brotli  # optional: br for clients that accept it; gzip otherwise
+except ImportError:
+    brotli = None
 
-app = Flask(__name__)
-CORS(app)  # Allow cross-origin requests
+load_dotenv('.env.local')
 
 API_BASE = "https://staging.highway.com/core/connect/external_api/v1"
 
+# Upstream client: one pool for the life of the process
+HIGHWAY_TIMEOUT = float(os.getenv('HIGHWAY_TIMEOUT', '30'))                 # per request (also the wait for a free connection)
+HIGHWAY_CONNECT_TIMEOUT = float(os.getenv('HIGHWAY_CONNECT_TIMEOUT', '10'))
+HIGHWAY_MAX_CONNECTIONS = int(os.getenv('HIGHWAY_MAX_CONNECTIONS', '20'))   # concurrent upstream requests
+HIGHWAY_MAX_KEEPALIVE = int(os.getenv('HIGHWAY_MAX_KEEPALIVE', '10'))       # idle connections kept open
+
+# Lookup cache (HIGHWAY_CACHE_TTL=0 turns it off)
+HIGHWAY_CACHE_TTL = float(os.getenv('HIGHWAY_CACHE_TTL', '3600'))                 # seconds an entry is fresh
+HIGHWAY_CACHE_STALE = float(os.getenv('HIGHWAY_CACHE_STALE', '86400'))            # then served stale while refreshing
+HIGHWAY_CACHE_NEGATIVE_TTL = float(os.getenv('HIGHWAY_CACHE_NEGATIVE_TTL', '300'))  # 404s
+HIGHWAY_CACHE_SIZE = int(os.getenv('HIGHWAY_CACHE_SIZE', '5000'))                 # entries kept in memory (LRU)
+HIGHWAY_CACHE_DB = os.getenv('HIGHWAY_CACHE_DB', '')  # SQLite file to keep the cache across restarts; empty = memory only
+HIGHWAY_CACHE_FLUSH_SECONDS = float(os.getenv('HIGHWAY_CACHE_FLUSH_SECONDS', '1'))  # new entries are written to it in batches this often
+
+# Bulk lookups
+HIGHWAY_BULK_MAX = int(os.getenv('HIGHWAY_BULK_MAX', '1000'))                 # identifiers per request
+HIGHWAY_BULK_CONCURRENCY = int(os.getenv('HIGHWAY_BULK_CONCURRENCY', '8'))    # upstream calls in flight per request
+
+# Responses
+HIGHWAY_COMPRESS_MIN = int(os.getenv('HIGHWAY_COMPRESS_MIN', '500'))        # bytes; smaller responses go uncompressed
+HIGHWAY_SCORECARD_FIELDS = os.getenv('HIGHWAY_SCORECARD_FIELDS', '')        # what ?fields=scorecard expands to
+
+log = logging.getLogger('highway_proxy')
+
+client: httpx.AsyncClient = None  # set in lifespan()
+cache: "CarrierCache" = None
+
+class Cached(NamedTuple):
+    status: int
+    body: bytes
+    headers: dict
+    fetched_at: float
+
+class CarrierCache:
+    """LRU of upstream responses with a TTL, negative caching of 404s and a
+    stale-while-revalidate window; optionally persisted to SQLite.
+
+    SQLite is written behind: put() only queues the row, and a background
+    task (start()) writes the queue in one transaction per flush_interval on
+    a worker thread, so the event loop never waits on a commit.
+    """
+
+    def __init__(self, size, ttl, negative_ttl, stale, path='', flush_interval=1.0):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale = stale
+        self.flush_interval = flush_interval
+        self.entries = OrderedDict()
+        self.hits = self.stale_hits = self.misses = 0
+        self.pending = {}  # key -> row not yet written to SQLite
+        self.writer = None
+        self.closing = None
+        self.db = None
+        if path:
+            # Used from worker threads (one at a time): opened in one, written in others
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("pragma journal_mode=wal")
+            self.db.execute("create table if not exists highway_cache ("
+                            "key text primary key, status integer, body blob, headers text, fetched_at real)")
+            self.db.execute("delete from highway_cache where fetched_at < ?", (time.time() - ttl - stale,))
+            self.db.commit()
+            rows = self.db.execute("select key, status, body, headers, fetched_at from highway_cache "
+                                   "order by fetched_at desc limit ?", (size,)).fetchall()
+            for key, status, body, headers, fetched_at in reversed(rows):
+                self.entries[key] = Cached(status, body, json.loads(headers), fetched_at)
+
+    def _max_age(self, entry):
+        return self.ttl if entry.status == 200 else self.negative_ttl
+
+    def get(self, key):
+        """(entry, 'fresh' | 'stale') or (None, None) on a miss."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            max_age = self._max_age(entry)
+            if age < max_age:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry, 'fresh'
+            if age < max_age + self.stale:
+                self.entries.move_to_end(key)
+                self.stale_hits += 1
+                return entry, 'stale'
+            del self.entries[key]
+        self.misses += 1
+        return None, None
+
+    def put(self, key, entry):
+        if entry.status not in (200, 404) or self.ttl <= 0:
+            return  # errors and rate limits are never cached
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        if self.db is not None:
+            self.pending[key] = (key, entry.status, entry.body, json.dumps(entry.headers), entry.fetched_at)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'stale': self.stale_hits, 'misses': self.misses}
+
+    def start(self):
+        """Start the SQLite writer (on the running loop)."""
+        if self.db is not None and self.writer is None:
+            self.closing = asyncio.Event()
+            self.writer = asyncio.create_task(self._write_behind())
+
+    async def _write_behind(self):
+        while not self.closing.is_set():
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.closing.wait(), self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write the queued entries in one transaction, off the event loop."""
+        if self.db is None or not self.pending:
+            return
+        rows, self.pending = list(self.pending.values()), {}
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except sqlite3.Error as e:
+            log.warning("Could not write %d cache entries to %s: %s", len(rows), HIGHWAY_CACHE_DB, e)
+
+    def _write(self, rows):
+        self.db.executemany("insert or replace into highway_cache values (?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    async def aclose(self):
+        """Flush what is queued and close SQLite."""
+        if self.writer is not None:
+            self.closing.set()
+            await self.writer  # its last pass flushes the queue
+            self.writer = None
+        await self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+INFLIGHT = {}  # key -> the upstream fetch every concurrent lookup of that key waits on
+UPSTREAM_STATS = {'requests': 0, 'coalesced': 0, 'errors': 0}
+
 def get_api_key():
     api_key = os.getenv('HIGHWAY_API_KEY')
     if not api_key:
         raise ValueError("HIGHWAY_API_KEY not found in .env.local")
     return api_key.replace(" ", "").replace("\n", "").replace("\r", "")
 
-@app.route('/proxy/carrier/<mc_number>', methods=['GET'])
-def get_carrier_by_mc(mc_number):
+async def highway_get(path):
+    """GET API_BASE + path on the shared client."""
+    return await client.get(f"{API_BASE}{path}", headers={'Authorization': f'Bearer {get_api_key()}'})
+
+async def fetch(key, path):
+    UPSTREAM_STATS['requests'] += 1
+    response = await highway_get(path)
+    # Only the content type is kept: upstream headers are not passed on
+    entry = Cached(response.status_code, response.content,
+                   {'content-type': response.headers.get('content-type', '')}, time.time())
+    cache.put(key, entry)
+    return entry
+
+def _fetch_done(key, task):
+    if INFLIGHT.get(key) is task:
+        del INFLIGHT[key]
+    if not task.cancelled() and task.exception() is not None:
+        UPSTREAM_STATS['errors'] += 1
+        log.warning("Upstream fetch of %s failed: %s", key, task.exception())
+
+def fetch_shared(key, path):
+    """The in-flight fetch of key, or a new one. A task, so a caller that goes away doesn't cancel it for the rest."""
+    task = INFLIGHT.get(key)
+    if task is not None and not task.done():
+        UPSTREAM_STATS['coalesced'] += 1
+        return task
+    task = INFLIGHT[key] = asyncio.create_task(fetch(key, path))
+    task.add_done_callback(lambda t: _fetch_done(key, t))
+    return task
+
+# Lookup kinds: cache key and upstream path per identifier
+LOOKUPS = {
+    'mc': lambda mc_number: (f"mc:{mc_number}", f"/carriers/MC/{mc_number}/by_identifier"),
+    'carrier': lambda carrier_id: (f"carrier:{carrier_id}", f"/carriers/{carrier_id}"),
+}
+
+def lookup_cached(key, path, refresh=False):
+    """(entry, 'HIT' | 'STALE') if the cache can answer now, else None. A stale entry is refreshed in the background."""
+    entry, state = (None, None) if refresh else cache.get(key)
+    if state == 'fresh':
+        return entry, 'HIT'
+    if state == 'stale':
+        if key not in INFLIGHT:
+            fetch_shared(key, path)  # background refresh
+        return entry, 'STALE'
+    return None
+
+async def lookup(key, path, refresh=False):
+    """Upstream response for path, through the cache. Returns (entry, 'HIT' | 'STALE' | 'MISS')."""
+    hit = lookup_cached(key, path, refresh)
+    if hit is not None:
+        return hit
+    return await asyncio.shield(fetch_shared(key, path)), 'MISS'
+
+def response_data(entry):
+    return json.loads(entry.body) if entry.status == 200 else entry.body.decode('utf-8', 'replace')
+
+def parse_fields(value):
+    """?fields=a,b.c (or the 'scorecard' preset) as a list of paths; None = the whole record."""
+    value = (value or '').strip()
+    if value == 'scorecard':
+        if not HIGHWAY_SCORECARD_FIELDS:
+            raise ValueError("fields=scorecard needs HIGHWAY_SCORECARD_FIELDS")
+        value = HIGHWAY_SCORECARD_FIELDS
+    paths = [tuple(p.strip().split('.')) for p in value.split(',') if p.strip()]
+    return paths or None
+
+def project(data, paths):
+    """Keep only the given paths; lists are projected item by item, missing keys are left out."""
+    if isinstance(data, list):
+        return [project(item, paths) for item in data]
+    if not isinstance(data, dict):
+        return data
+    wanted = {}
+    for head, *rest in paths:
+        wanted.setdefault(head, []).append(tuple(rest))
+    return {head: data[head] if () in rests else project(data[head], rests)
+            for head, rests in wanted.items() if head in data}
+
+def envelope(entry, fields=None, **extra):
+    """{**extra, "status", "data"} as JSON bytes. Without a projection a JSON
+    upstream body is spliced in unparsed."""
+    head = json.dumps({**extra, 'status': entry.status})[:-1].encode()
+    if (entry.status == 200 and fields is None and entry.body.strip()
+            and 'json' in entry.headers.get('content-type', '')):
+        data = entry.body
+    else:
+        data = response_data(entry)
+        if fields is not None and entry.status == 200:
+            data = project(data, fields)
+        data = json.dumps(data).encode()
+    return head + b', "data": ' + data + b'}'
+
+def encoded_response(request, body, status_code=200, headers=None):
+    """JSON response, brotli-compressed when the client takes br. gzip is left to GZipMiddleware."""
+    headers = dict(headers or {})
+    if brotli is not None and len(body) >= HIGHWAY_COMPRESS_MIN and 'br' in request.headers.get('accept-encoding', ''):
+        body = brotli.compress(body, quality=5)
+        headers.update({'Content-Encoding': 'br', 'Vary': 'Accept-Encoding'})
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
+
+def proxy_response(request, entry, cache_state, fields=None):
+    return encoded_response(request, envelope(entry, fields), entry.status, {'X-Cache': cache_state})
+
+def wants_refresh(request):
+    return request.query_params.get('refresh', '') not in ('', '0', 'false')
+
+async def get_carrier_by_mc(request):
     """Proxy endpoint to get carrier by MC number"""
     try:
-        api_key = get_api_key()
-        
+        fields = parse_fields(request.query_params.get('fields'))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    try:
         # Try the by_identifier endpoint
-        url = f"{API_BASE}/carriers/MC/{mc_number}/by_identifier"
-        
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {api_key}',
-            'User-Agent': 'HighwayScorecard/1.7',
-        }
-        
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        return jsonify({
-            'status': response.status_code,
-            'data': response.json() if response.status_code == 200 else response.text,
-            'headers': dict(response.headers)
-        }), response.status_code
-        
+        key, path = LOOKUPS['mc'](request.path_params['mc_number'].strip())
+        entry, state = await lookup(key, path, wants_refresh(request))
+        return proxy_response(request, entry, state, fields)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse({'error': str(e)}, status_code=500)
 
-@app.route('/proxy/carrier-detail/<carrier_id>', methods=['GET'])
-def get_carrier_detail(carrier_id):
+async def get_carrier_detail(request):
     """Proxy endpoint to get carrier detail by ID"""
     try:
-        api_key = get_api_key()
-        
-        url = f"{API_BASE}/carriers/{carrier_id}"
-        
-        headers = {
+        fields = parse_fields(request.query_params.get('fields'))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    try:
+        key, path = LOOKUPS['carrier'](request.path_params['carrier_id'].strip())
+        entry, state = await lookup(key, path, wants_refresh(request))
+        return proxy_response(request, entry, state, fields)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+IDENTIFIER = re.compile(r'[A-Za-z0-9_-]{1,64}')
+BULK_FIELDS = {'mc_numbers': ('mc', 'mc_number'), 'carrier_ids': ('carrier', 'carrier_id')}
+
+def _bulk_line(field, ident, entry=None, cache_state=None, error=None, fields=None):
+    if error is not None:
+        return json.dumps({field: ident, 'status': 500, 'error': error}).encode() + b"\n"
+    return envelope(entry, fields, **{field: ident, 'cache': cache_state}) + b"\n"
+
+async def bulk_lookup(request):
+    """Look up many carriers: {"mc_numbers": [...], "carrier_ids": [...], "fields": "a,b.c", "refresh": false}.
+
+    Streams one NDJSON line per identifier as it completes; cache hits come first.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({'error': 'body must be JSON'}, status_code=400)
+    if not isinstance(body, dict):
+        return JSONResponse({'error': 'expected {"mc_numbers": [...], "carrier_ids": [...]}'}, status_code=400)
+    items = {}  # (kind, identifier) -> output field; duplicates looked up once
+    for name, (kind, field) in BULK_FIELDS.items():
+        values = body.get(name) or []
+        if not isinstance(values, list):
+            return JSONResponse({'error': f'{name} must be a list'}, status_code=400)
+        for value in values:
+            ident = str(value).strip()
+            if not IDENTIFIER.fullmatch(ident):
+                return JSONResponse({'error': f'invalid {field}: {value!r}'}, status_code=400)
+            items[(kind, ident)] = field
+    if not items:
+        return JSONResponse({'error': 'no mc_numbers or carrier_ids'}, status_code=400)
+    if len(items) > HIGHWAY_BULK_MAX:
+        return JSONResponse({'error': f'at most {HIGHWAY_BULK_MAX} identifiers per request'}, status_code=413)
+    refresh = bool(body.get('refresh'))
+    fields = body.get('fields')
+    try:
+        fields = parse_fields(','.join(fields) if isinstance(fields, list) else fields)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    async def results():
+        misses = []
+        for (kind, ident), field in items.items():
+            key, path = LOOKUPS[kind](ident)
+            hit = lookup_cached(key, path, refresh)
+            if hit is not None:
+                yield _bulk_line(field, ident, *hit, fields=fields)
+            else:
+                misses.append((field, ident, key, path))
+
+        limit = asyncio.Semaphore(HIGHWAY_BULK_CONCURRENCY)
+        async def one(field, ident, key, path):
+            async with limit:
+                try:
+                    entry = await asyncio.shield(fetch_shared(key, path))
+                    return _bulk_line(field, ident, entry, 'MISS', fields=fields)
+                except Exception as e:
+                    return _bulk_line(field, ident, error=str(e))
+
+        tasks = [asyncio.create_task(one(*miss)) for miss in misses]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:  # client went away
+                task.cancel()
+
+    return StreamingResponse(results(), media_type='application/x-ndjson')
+
+async def health(request):
+    return JSONResponse({'status': 'ok', 'message': 'Highway API proxy server is running',
+                         'cache': cache.stats(),
+                         'upstream': {**UPSTREAM_STATS, 'in_flight': len(INFLIGHT)}})
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global client, cache
+    # Opening, pruning and loading the SQLite file blocks: keep it off the loop too
+    cache = await asyncio.to_thread(CarrierCache, HIGHWAY_CACHE_SIZE, HIGHWAY_CACHE_TTL, HIGHWAY_CACHE_NEGATIVE_TTL,
+                                    HIGHWAY_CACHE_STALE, HIGHWAY_CACHE_DB, HIGHWAY_CACHE_FLUSH_SECONDS)
+    cache.start()
+    client = httpx.AsyncClient(
+        headers={
             'Accept': 'application/json',
-            'Authorization': f'Bearer {api_key}',
             'User-Agent': 'HighwayScorecard/1.7',
-        }
-        
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        return jsonify({
-            'status': response.status_code,
-            'data': response.json() if response.status_code == 200 else response.text,
-            'headers': dict(response.headers)
-        }), response.status_code
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        },
+        timeout=httpx.Timeout(HIGHWAY_TIMEOUT, connect=HIGHWAY_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=HIGHWAY_MAX_CONNECTIONS,
+                            max_keepalive_connections=HIGHWAY_MAX_KEEPALIVE),
+    )
+    try:
+        yield
+    finally:
+        for task in list(INFLIGHT.values()):
+            task.cancel()
+        await client.aclose()
+        await cache.aclose()
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'ok', 'message': 'Highway API proxy server is running'})
+app = Starlette(
+    routes=[
+        Route('/proxy/carrier/{mc_number}', get_carrier_by_mc, methods=['GET']),
+        Route('/proxy/carrier-detail/{carrier_id}', get_carrier_detail, methods=['GET']),
+        Route('/proxy/carriers/bulk', bulk_lookup, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+    ],
+    # Allow cross-origin requests
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(GZipMiddleware, minimum_size=HIGHWAY_COMPRESS_MIN, compresslevel=6),
+    ],
+    lifespan=lifespan,
+)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Highway API proxy server")
+    parser.add_argument('--host', default=os.getenv('HIGHWAY_PROXY_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('HIGHWAY_PROXY_PORT', '5001')))
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
     print("🚀 Starting Highway API Proxy Server...")
     print("📍 Endpoints:")
     print("   GET /proxy/carrier/<mc_number> - Get carrier by MC number")
     print("   GET /proxy/carrier-detail/<carrier_id> - Get carrier detail")
+    print("   POST /proxy/carriers/bulk - Look up many carriers (NDJSON stream)")
     print("   GET /health - Health check")
     print("\n⚠️  Make sure this server is accessible from your Next.js app")
-    print("   Run with: python3 scripts/highway-proxy-server.py")
-    print("   Or with Flask: FLASK_APP=scripts/highway-proxy-server.py flask run --host=0.0.0.0 --port=5001")
-    app.run(host='0.0.0.0', port=5001, debug=True)
-
+    print("   Run with: python3 scripts/highway-proxy-server.py --port 5001")
+    uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
@@ -3,21 +3,36 @@
 # Works with python-telegram-bot v22.x
 import os
 import re
+import json
+import math
+import asyncio
 import time
+import random
 import signal
+import argparse
+import functools
+import hashlib
+import hmac
+import http.server
 import logging
+import logging.handlers
 import threading
-from collections import deque
+from collections import deque, OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Optional, List, Any
+from typing import Callable, Dict, Optional, List, Any, Iterator
+from zoneinfo import ZoneInfo
 
 from dotenv import load_dotenv
 import humanize
 import psycopg
 from psycopg.rows import dict_row
 from psycopg.types.json import Json  # <- ensure JSON parameters are sent as JSON
+from psycopg_pool import AsyncConnectionPool
+import httpx  # Shared keep-alive client for notification webhook calls
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 
 from telegram import Update, Message
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
@@ -25,6 +40,8 @@ from telegram.ext import (
     filters,
 )
 
+from forward_scheduler import ForwardScheduler  # shared with the Telethon forwarder
+
 # ----- UI (rich) -----
 from rich.console import Console, Group
 from rich.panel import Panel
@@ -40,12 +57,100 @@ load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("BOT_TOKEN")
 SRC_CHAT = os.getenv("TELEGRAM_SOURCE_CHAT_ID") or os.getenv("SOURCE_CHANNEL_ID")
 DST_CHAT = os.getenv("TELEGRAM_TARGET_GROUP_ID") or os.getenv("TARGET_GROUP_ID")
+# Routing table: JSON file path or inline JSON (see README); empty = the one source/target pair above
+ROUTES_CONFIG = os.getenv("FORWARDER_ROUTES", "").strip()
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 
+# Connection pool sizing (one long-lived pool instead of a connect per bid)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))              # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))           # close idle conns above min_size after this
+DB_POOL_RECONNECT_TIMEOUT = float(os.getenv("DB_POOL_RECONNECT_TIMEOUT", "300"))  # give up reconnecting after this
+
+# Ingest pipeline: parsed bids are queued and written in multi-row batches
+INGEST_QUEUE_MAXSIZE = int(os.getenv("INGEST_QUEUE_MAXSIZE", "1000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "50"))
+INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "50"))               # max wait before flushing a partial batch
+BID_CACHE_SIZE = int(os.getenv("BID_CACHE_SIZE", "20000"))              # last persisted fields per bid (edit/duplicate check)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # URL to trigger notifications (e.g., https://your-app.railway.app/api/webhooks/new-bid)
+WEBHOOK_API_KEY = os.getenv("WEBHOOK_API_KEY", "")  # Optional API key for webhook security
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_HTTP2 = os.getenv("WEBHOOK_HTTP2", "1").lower() not in ("0", "false", "no")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "10"))
+# Batched mode: coalesce bids that land within this window into one {"bidNumbers": [...]} call (0 = one call per bid)
+WEBHOOK_BATCH_MS = int(os.getenv("WEBHOOK_BATCH_MS", "0"))
+WEBHOOK_BATCH_MAX = int(os.getenv("WEBHOOK_BATCH_MAX", "100"))
+
+# Notification outbox (see db/migrations/121_telegram_bid_notification_outbox.sql)
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4"))      # parallel webhook calls
+OUTBOX_CLAIM_LIMIT = int(os.getenv("OUTBOX_CLAIM_LIMIT", "100"))    # cap on rows leased per dispatch pass (one round of calls)
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))  # idle poll for retries coming due
+OUTBOX_BASE_BACKOFF = float(os.getenv("OUTBOX_BASE_BACKOFF", "2"))  # seconds, doubled per attempt
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "15"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+# Raw source-update log, replayable with --replay (set INGEST_LOG_PATH= to disable)
+INGEST_LOG_PATH = os.getenv("INGEST_LOG_PATH", os.path.join(os.path.dirname(__file__), "..", "logs", "ingest.ndjson"))
+INGEST_LOG_MAX_BYTES = int(os.getenv("INGEST_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+INGEST_LOG_BACKUPS = int(os.getenv("INGEST_LOG_BACKUPS", "8"))
+
+# Per-post budgets for the two independent halves of the handler
+FORWARD_TIMEOUT = float(os.getenv("FORWARD_TIMEOUT", "30"))  # one copy_message attempt
+INGEST_TIMEOUT = float(os.getenv("INGEST_TIMEOUT", "10"))    # parse + hand-off to the DB writer (queue backpressure)
+
+# Forward scheduler: Telegram's flood limits (groups ~20 msgs/min and 1/s, ~30/s per bot)
+FORWARD_CHAT_PER_MINUTE = float(os.getenv("FORWARD_CHAT_PER_MINUTE", "20"))
+FORWARD_CHAT_BURST = int(os.getenv("FORWARD_CHAT_BURST", "5"))
+FORWARD_CHAT_MIN_INTERVAL = float(os.getenv("FORWARD_CHAT_MIN_INTERVAL", "1"))
+FORWARD_GLOBAL_PER_SECOND = float(os.getenv("FORWARD_GLOBAL_PER_SECOND", "30"))
+FORWARD_MAX_ATTEMPTS = int(os.getenv("FORWARD_MAX_ATTEMPTS", "5"))  # network errors; RetryAfter always waits
+FORWARD_DRAIN_TIMEOUT = float(os.getenv("FORWARD_DRAIN_TIMEOUT", "10"))  # on shutdown
+
+# Startup catch-up: process posts queued while the bot was down (0 = drop them, the old behaviour)
+CATCHUP_ON_START = os.getenv("CATCHUP_ON_START", "1").lower() not in ("0", "false", "no")
+
+# Status output: auto = Rich dashboard on a TTY, NDJSON otherwise; rich / json / off force one
+FORWARDER_UI = os.getenv("FORWARDER_UI", "auto").lower()
+UI_MAX_FPS = float(os.getenv("UI_MAX_FPS", "10"))  # cap on redraws during bursts
+STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL", "1"))     # min seconds between NDJSON writes
+STATUS_HEARTBEAT = float(os.getenv("STATUS_HEARTBEAT", "15"))  # status snapshot even when nothing changed
+
+# Per-bid stage traces as OTLP/JSON lines (set TRACE_PATH= to disable); --trace-summary reads them
+TRACE_PATH = os.getenv("TRACE_PATH", os.path.join(os.path.dirname(__file__), "..", "logs", "bid_traces.otlp.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(16 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "8"))
+
+# Prometheus /metrics (0 = off); server.js proxies it on its public port behind METRICS_TOKEN
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
+
+# How updates arrive: polling (long-poll getUpdates) or webhook (Telegram pushes
+# them to TELEGRAM_WEBHOOK_URL; server.js proxies /telegram/webhook to the receiver)
+TELEGRAM_UPDATES = os.getenv("TELEGRAM_UPDATES", "polling").lower()
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "").strip()  # empty = receiver only (local testing)
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+TELEGRAM_WEBHOOK_ADDR = os.getenv("TELEGRAM_WEBHOOK_ADDR", "127.0.0.1")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8081"))
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "1"))  # 1 keeps source order
+
+# High availability: replicas elect the active poller with a Postgres advisory lock;
+# the others wait as warm standbys. HA_SHARDS > 1 splits the routes across replicas
+# (shard k polls with TELEGRAM_BOT_TOKEN_k; shard 0 with TELEGRAM_BOT_TOKEN)
+HA_ENABLED = os.getenv("FORWARDER_HA", "0").lower() in ("1", "true", "yes", "on")
+HA_SHARDS = int(os.getenv("HA_SHARDS", "1"))
+HA_RETRY_SECONDS = float(os.getenv("HA_RETRY_SECONDS", "2"))   # standby: how often to try for the lock
+HA_CHECK_SECONDS = float(os.getenv("HA_CHECK_SECONDS", "5"))   # leader: how often to check it still holds it
+# Session-level locks need a session: required with FORWARDER_HA=1, and must be a direct /
+# session-mode URL (a transaction-mode pooler hands the lock's session to other clients)
+HA_DATABASE_URL = os.getenv("HA_DATABASE_URL", "")
+
 # ================== PREFLIGHT CHECKS ==================
 import sys
 import socket
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
 
 def parse_database_url(url: str) -> dict:
     """Parse DATABASE_URL and extract components for logging."""
@@ -62,6 +167,12 @@ def parse_database_url(url: str) -> dict:
     except Exception as e:
         return {'error': str(e), 'full_url': url}
 
+def is_transaction_pooler(url: str) -> bool:
+    """True for URLs that go through a transaction-mode pooler (Supabase port 6543, pgbouncer=true)."""
+    db_info = parse_database_url(url)
+    query = parse_qs(urlparse(url).query)
+    return db_info.get('port') == 6543 or query.get('pgbouncer', [''])[-1].lower() == 'true'
+
 def preflight_database_check():
     """Blocking preflight check for database connectivity."""
     if not DATABASE_URL:
@@ -104,16 +215,16 @@ def preflight_database_check():
         logging.error(f"DB preflight failed - connection error: {e}")
         sys.exit(1)
 
-# Run preflight checks before starting the bot
-preflight_database_check()
-
-if not BOT_TOKEN or not SRC_CHAT or not DST_CHAT:
-    raise SystemExit(
-        "Missing TELEGRAM_BOT_TOKEN (or BOT_TOKEN) / TELEGRAM_SOURCE_CHAT_ID / TELEGRAM_TARGET_GROUP_ID in .env"
-    )
+def require_telegram_config():
+    if not BOT_TOKEN or not (ROUTES_CONFIG or (SRC_CHAT and DST_CHAT)):
+        raise SystemExit(
+            "Missing TELEGRAM_BOT_TOKEN (or BOT_TOKEN) / TELEGRAM_SOURCE_CHAT_ID / TELEGRAM_TARGET_GROUP_ID"
+            " (or FORWARDER_ROUTES) in .env"
+        )
 
-SOURCE_CHAT_ID = int(SRC_CHAT)
-TARGET_CHAT_ID = int(DST_CHAT)
+# Checks run from main(), so the parser and DB helpers can be imported on their own
+SOURCE_CHAT_ID = int(SRC_CHAT) if SRC_CHAT else 0
+TARGET_CHAT_ID = int(DST_CHAT) if DST_CHAT else 0
 POSTGRES_ENABLED = bool(DATABASE_URL)
 
 # ================= LOGGING =================
@@ -134,12 +245,92 @@ console = Console(force_terminal=True, soft_wrap=False)
 if POSTGRES_ENABLED:
     log.info("Postgres enabled.")
 
+# ================= RAW INGEST LOG =================
+# One compact JSON line per source update, written before any processing:
+#   {"id": message_id, "chat": chat_id, "ts": posted epoch, "rx": received epoch, "edit": bool, "text": ...}
+# "rx" is the received_at the live path stamped, so a replay produces the
+# same rows and outbox keys (no duplicate notifications for bids already sent).
+ingest_log = logging.getLogger("nova.tele.ingest")
+ingest_log.propagate = False
+
+def ingest_log_open() -> None:
+    if not INGEST_LOG_PATH or ingest_log.handlers:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(INGEST_LOG_PATH)), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        INGEST_LOG_PATH, maxBytes=INGEST_LOG_MAX_BYTES, backupCount=INGEST_LOG_BACKUPS, encoding="utf-8",
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    ingest_log.addHandler(handler)
+    ingest_log.setLevel(logging.INFO)
+
+def ingest_log_close() -> None:
+    for handler in list(ingest_log.handlers):
+        ingest_log.removeHandler(handler)
+        handler.close()
+
+def ingest_log_append(message_id: int, chat_id: int, posted_at: Optional[datetime],
+                      received_at: datetime, text: str, edited: bool = False) -> None:
+    if not ingest_log.handlers:
+        return
+    entry = {
+        "id": message_id,
+        "chat": chat_id,
+        "ts": posted_at.timestamp() if posted_at else received_at.timestamp(),
+        "rx": received_at.timestamp(),
+        "text": text,
+    }
+    if edited:
+        entry["edit"] = True
+    ingest_log.info(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+
+def rotated_log_files(path: str) -> List[str]:
+    """A RotatingFileHandler log and its backups, oldest first."""
+    files = []
+    n = 1
+    while os.path.exists(f"{path}.{n}"):
+        files.append(f"{path}.{n}")
+        n += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def read_ingest_log(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        for name in rotated_log_files(path):
+            with open(name, encoding="utf-8") as f:
+                for n, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        log.warning("Skipping unreadable ingest log line %s:%d", name, n)
+
 # ================= STATE =================
 COUNTDOWN_MINUTES = 30
 WINDOW_SECONDS = COUNTDOWN_MINUTES * 60
 EVENT_ROWS = 10  # fixed height for recent events panel
 
-STATE = {
+class UIState(dict):
+    """STATE dict that counts writes, so the UI redraws only after something changed."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+        self.events_version = 0
+        self.changed = threading.Event()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.touch()
+
+    def touch(self) -> None:
+        self.version += 1
+        self.changed.set()
+
+STATE = UIState({
     "connected": False,
     "last_error": "",
     "forwarded_count": 0,
@@ -148,13 +339,220 @@ STATE = {
     "last_tag": None,          # type: Optional[str]
     "last_bid_at": None,       # type: Optional[datetime]
     "last_src_msg_id": None,
+    "queue_depth": 0,          # bids waiting for the DB writer
+    "queue_peak": 0,
+    "db_batches": 0,
+    "forward_backlog": 0,      # posts waiting for (or in) copy_message
+    "role": "active",          # or "standby" / "active (shard N)" with FORWARDER_HA
     "events": deque(maxlen=100),
-}
+})
 STOP_EVENT = threading.Event()
+STARTED_AT = time.monotonic()
 
 def push_event(txt: str, style: str = "cyan"):
     ts = datetime.now().strftime("%H:%M:%S")
-    STATE["events"].appendleft((f"[{ts}] {txt}", style))
+    # events_version doubles as the event's sequence number for the NDJSON stream
+    STATE.events_version += 1
+    STATE["events"].appendleft((STATE.events_version, ts, txt, style))
+    STATE.touch()
+
+# ================= METRICS =================
+# Process-lifetime Prometheus metrics; a restart resets them, which
+# Prometheus' rate()/increase() already account for.
+_FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+_IO_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+M_PARSE_SECONDS = Histogram("nova_forwarder_parse_seconds", "parse_bid time per source post", buckets=_FAST_BUCKETS)
+M_DB_UPSERT_SECONDS = Histogram("nova_forwarder_db_upsert_seconds",
+                                "Multi-row telegram_bids upsert (+ outbox insert) transaction time", buckets=_IO_BUCKETS)
+M_DB_UPSERT_ROWS = Histogram("nova_forwarder_db_upsert_rows", "Bids per upsert batch",
+                             buckets=(1, 2, 5, 10, 25, 50, 100, 250))
+M_WEBHOOK_SECONDS = Histogram("nova_forwarder_webhook_seconds", "Notification webhook call latency",
+                              ["outcome"], buckets=_IO_BUCKETS)
+M_COPY_SECONDS = Histogram("nova_forwarder_copy_message_seconds", "Telegram copy_message latency",
+                           ["outcome"], buckets=_IO_BUCKETS)
+M_POSTS = Counter("nova_forwarder_posts_total", "Source channel posts handled")
+M_BIDS_PARSED = Counter("nova_forwarder_bids_parsed_total", "Posts that parsed as a bid")
+M_PARSE_MISSES = Counter("nova_forwarder_parse_misses_total", "Posts that did not match the bid pattern")
+M_ERRORS = Counter("nova_forwarder_errors_total", "Failures by pipeline stage", ["stage"])
+M_ROUTE_POSTS = Counter("nova_forwarder_route_posts_total", "Source posts per route ('unrouted' = no route)",
+                        ["route"])
+M_ROUTE_BIDS = Counter("nova_forwarder_route_bids_total", "Parsed bids per route", ["route"])
+M_ROUTE_FORWARDS = Counter("nova_forwarder_route_forwards_total", "Posts copied per route and target chat",
+                           ["route", "target"])
+M_BID_WRITES = Counter("nova_forwarder_bid_writes_total", "Parsed bids by upsert outcome (new/updated/unchanged)",
+                       ["outcome"])
+M_QUEUE_DEPTH = Gauge("nova_forwarder_ingest_queue_depth", "Bids waiting for the DB writer")
+M_QUEUE_DEPTH.set_function(lambda: INGEST_QUEUE.qsize() if INGEST_QUEUE is not None else 0)
+
+M_FORWARD_BACKLOG = Gauge("nova_forwarder_forward_backlog", "Posts queued or in flight in the forward scheduler")
+M_FORWARD_BACKLOG.set_function(lambda: FORWARDER.backlog if FORWARDER is not None else 0)
+M_HA_ACTIVE = Gauge("nova_forwarder_ha_active", "1 while this replica holds the leader lock (or HA is off)")
+M_HA_ACTIVE.set_function(lambda: 1 if STATE["role"].startswith("active") else 0)
+M_FORWARD_RETRIES = Counter("nova_forwarder_forward_retries_total", "copy_message attempts retried", ["reason"])
+
+def _pool_stat(key: str) -> float:
+    return DB_POOL.get_stats().get(key, 0) if DB_POOL is not None else 0
+
+M_POOL_SIZE = Gauge("nova_forwarder_db_pool_connections", "Connections currently open in the DB pool")
+M_POOL_SIZE.set_function(lambda: _pool_stat("pool_size"))
+M_POOL_IDLE = Gauge("nova_forwarder_db_pool_idle_connections", "Open DB pool connections not in use")
+M_POOL_IDLE.set_function(lambda: _pool_stat("pool_available"))
+M_POOL_WAITING = Gauge("nova_forwarder_db_pool_waiting_requests", "Tasks waiting for a DB pool connection")
+M_POOL_WAITING.set_function(lambda: _pool_stat("requests_waiting"))
+M_POOL_MAX = Gauge("nova_forwarder_db_pool_max_connections", "DB pool max_size")
+M_POOL_MAX.set(DB_POOL_MAX_SIZE)
+
+def metrics_start() -> None:
+    if METRICS_PORT <= 0:
+        return
+    try:
+        start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+        log.info("Metrics on http://%s:%d/metrics", METRICS_ADDR, METRICS_PORT)
+    except OSError as e:
+        log.warning("Metrics endpoint not started on %s:%d: %s", METRICS_ADDR, METRICS_PORT, e)
+
+# ================= TRACING =================
+# Each source post gets a BidTrace on handler entry. Stages add spans as
+# they finish (the record carries the trace through the ingest queue, the
+# outbox keeps it by idempotency key until the webhook answers) and the
+# whole trace is written as one OTLP/JSON ExportTraceServiceRequest line,
+# the format the OpenTelemetry collector's file exporter/receiver use.
+# The root span starts at the Telegram post date (whole seconds).
+trace_log = logging.getLogger("nova.tele.trace")
+trace_log.propagate = False
+TRACE_PENDING: "OrderedDict[str, BidTrace]" = OrderedDict()  # outbox idempotency key -> trace
+TRACE_PENDING_MAX = 10000
+_TRACE_RESOURCE = {"attributes": [{"key": "service.name", "value": {"stringValue": "nova-telegram-forwarder"}}]}
+_TRACE_SCOPE = {"name": "nova.tele.forwarder"}
+
+def trace_log_open() -> None:
+    if not TRACE_PATH or trace_log.handlers:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(TRACE_PATH)), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        TRACE_PATH, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding="utf-8",
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_log.addHandler(handler)
+    trace_log.setLevel(logging.INFO)
+
+def trace_log_close() -> None:
+    for handler in list(trace_log.handlers):
+        trace_log.removeHandler(handler)
+        handler.close()
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+class BidTrace:
+    """Stage spans for one source post; written out once by finish()."""
+    __slots__ = ("trace_id", "root_id", "posted_ns", "entry_ns", "mark_ns", "attrs", "spans", "finished")
+
+    def __init__(self, posted_at: Optional[datetime], **attrs):
+        self.trace_id = os.urandom(16).hex()
+        self.root_id = os.urandom(8).hex()
+        self.entry_ns = time.time_ns()
+        posted_ns = int(posted_at.timestamp()) * 1_000_000_000 if posted_at else self.entry_ns
+        self.posted_ns = min(posted_ns, self.entry_ns)
+        self.mark_ns = self.entry_ns  # end of the last stage, for wait spans
+        self.attrs = attrs
+        self.spans: List[Dict[str, Any]] = []
+        self.finished = False
+        self.span("telegram.delivery", self.posted_ns, self.entry_ns)
+
+    def span(self, name: str, start_ns: int, end_ns: int, error: Optional[str] = None, **attrs) -> None:
+        span = self._span(name, os.urandom(8).hex(), self.root_id, start_ns, end_ns, error, attrs)
+        if self.finished:
+            # A stage that outlived the trace (e.g. a slow forward): same trace id, own line
+            self._write([span])
+        else:
+            self.spans.append(span)
+
+    def _span(self, name, span_id, parent_id, start_ns, end_ns, error, attrs) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": span_id,
+            "name": name,
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(max(start_ns, end_ns)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items() if v is not None],
+            "status": {"code": 2, "message": error} if error else {"code": 1},
+        }
+        if parent_id:
+            span["parentSpanId"] = parent_id
+        return span
+
+    def finish(self, outcome: str, error: Optional[str] = None) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        attrs = dict(self.attrs, outcome=outcome, **{"handler.entry_unix_nano": self.entry_ns})
+        root = self._span("telegram.post", self.root_id, None, self.posted_ns, time.time_ns(), error, attrs)
+        self._write([root] + self.spans)
+        self.spans = []
+
+    @staticmethod
+    def _write(spans: List[Dict[str, Any]]) -> None:
+        if not trace_log.handlers:
+            return
+        line = {"resourceSpans": [{"resource": _TRACE_RESOURCE,
+                                   "scopeSpans": [{"scope": _TRACE_SCOPE, "spans": spans}]}]}
+        trace_log.info(json.dumps(line, separators=(",", ":")))
+
+def trace_await_webhook(key: str, trace: BidTrace, committed_ns: int) -> None:
+    trace.mark_ns = committed_ns
+    TRACE_PENDING[key] = trace
+    while len(TRACE_PENDING) > TRACE_PENDING_MAX:
+        TRACE_PENDING.popitem(last=False)[1].finish("untracked")
+
+def _trace_upsert(records: List[Dict[str, Any]], latest: Dict[str, Dict[str, Any]], rows: int,
+                  started_ns: int, error: Optional[str] = None,
+                  outcomes: Optional[Dict[str, str]] = None) -> None:
+    ended_ns = time.time_ns()
+    for d in records:
+        trace = d.get("_trace")
+        if trace is None:
+            continue
+        if d.get("_queued_ns"):
+            trace.span("ingest.queue", d["_queued_ns"], started_ns)
+        outcome = (outcomes or {}).get(d["bid_number"], "new")
+        if outcome != "unchanged":
+            trace.span("db.upsert", started_ns, ended_ns, error, rows=rows)
+        if error:
+            trace.finish("db_error", error)
+        elif latest.get(d["bid_number"]) is not d:
+            trace.finish("superseded")  # a later edit of the same bid in this batch won
+        elif outcome != "new":
+            trace.finish(outcome)  # updated / unchanged: no notification
+        elif OUTBOX_ENABLED:
+            trace_await_webhook(outbox_key(d), trace, ended_ns)
+        else:
+            trace.finish("stored")
+
+def _trace_webhook(rows: List[Dict[str, Any]]) -> None:
+    for r in rows:
+        key = r["idempotency_key"]
+        trace = TRACE_PENDING.get(key)
+        if trace is None or "_sent_ns" not in r:
+            continue
+        sent_ns, answered_ns = r["_sent_ns"]
+        trace.span("outbox.wait", trace.mark_ns, sent_ns, attempt=r["attempts"])
+        trace.span("webhook", sent_ns, answered_ns, r.get("error"), attempt=r["attempts"])
+        trace.mark_ns = answered_ns
+        if not r.get("error"):
+            del TRACE_PENDING[key]
+            trace.finish("notified")
+        elif r["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            del TRACE_PENDING[key]
+            trace.finish("notify_failed", r.get("error"))
 
 # ============== PARSER (robust & tolerant) ==============
 RX_BID     = re.compile(r"^\s*New\s+Load\s+Bid:\s*(?P<bid>\d+)\s*$", re.I | re.M)
@@ -164,25 +562,47 @@ RX_DELIV   = re.compile(r"^\s*Delivery:\s*(?P<deliv>.+?)\s*$", re.I | re.M)
 RX_TAG     = re.compile(r"^\s*#(?P<tag>[A-Za-z0-9_-]+)\s*$", re.I | re.M)
 RX_STOP    = re.compile(r"^\s*Stop\s*\d+:\s*(?P<place>.+?)\s*$", re.I | re.M)
 
-def parse_datetime_string(dt_str: str) -> Optional[datetime]:
-    """Parse datetime string in various formats and return in CST timezone."""
+# Telegram posts carry local (Central) wall-clock times
+CENTRAL_TZ = ZoneInfo("America/Chicago")
+# Fixed offset that timestamps were stamped with before DST-aware parsing
+LEGACY_CDT_TZ = timezone(timedelta(hours=-5))
+DT_CACHE_SIZE = int(os.getenv("DT_CACHE_SIZE", "4096"))
+
+DT_FORMATS = (
+    "%m/%d/%Y %I:%M %p",      # 09/30/2025 02:00 AM
+    "%m/%d/%Y %H:%M",         # 09/30/2025 14:00
+    "%m-%d-%Y %I:%M %p",      # 09-30-2025 02:00 AM
+    "%m-%d-%Y %H:%M",         # 09-30-2025 14:00
+    "%Y-%m-%d %H:%M",         # 2025-09-30 14:00
+    "%Y-%m-%d %I:%M %p",      # 2025-09-30 02:00 PM
+    "%m/%d/%Y",               # 09/30/2025 (date only)
+    "%m-%d-%Y",               # 09-30-2025 (date only)
+    "%Y-%m-%d",               # 2025-09-30 (date only)
+)
+RX_DT_LOOSE = re.compile(r'(\d{1,2})[/-](\d{1,2})[/-](\d{4})\s+(\d{1,2}):(\d{2})\s*(AM|PM)?', re.I)
+
+# Shapes of DT_FORMATS, sniffed in one match. ASCII digits only; anything
+# else (odd padding, Unicode digits, trailing text) takes the strptime path.
+_RX_DT_TIME = r"(?:\s+(?P<H>[0-9]{1,2}):(?P<M>[0-9]{1,2})(?:\s+(?P<p>[AP]M))?)?"
+RX_DT_MDY = re.compile(r"(?P<m>[0-9]{1,2})(?P<sep>[/-])(?P<d>[0-9]{1,2})(?P=sep)(?P<y>[0-9]{4})" + _RX_DT_TIME, re.I)
+RX_DT_YMD = re.compile(r"(?P<y>[0-9]{4})-(?P<m>[0-9]{1,2})-(?P<d>[0-9]{1,2})" + _RX_DT_TIME, re.I)
+
+def to_central(naive: datetime) -> datetime:
+    """Attach America/Chicago to a wall-clock time.
+
+    The repeated hour in November resolves to its first (CDT) occurrence.
+    A time in the hour skipped in March is moved forward past the gap
+    (02:30 -> 03:30 CDT), since zoneinfo gives it the pre-gap offset and
+    the UTC round trip normalises it.
+    """
+    return naive.replace(tzinfo=CENTRAL_TZ).astimezone(timezone.utc).astimezone(CENTRAL_TZ)
+
+def parse_datetime_string_strptime(dt_str: str) -> Optional[datetime]:
+    """Reference parser: try each of DT_FORMATS with strptime, then a loose regex."""
     if not dt_str:
         return None
     
-    # Common datetime formats to try
-    formats = [
-        "%m/%d/%Y %I:%M %p",      # 09/30/2025 02:00 AM
-        "%m/%d/%Y %H:%M",         # 09/30/2025 14:00
-        "%m-%d-%Y %I:%M %p",      # 09-30-2025 02:00 AM
-        "%m-%d-%Y %H:%M",         # 09-30-2025 14:00
-        "%Y-%m-%d %H:%M",         # 2025-09-30 14:00
-        "%Y-%m-%d %I:%M %p",      # 2025-09-30 02:00 PM
-        "%m/%d/%Y",               # 09/30/2025 (date only)
-        "%m-%d-%Y",               # 09-30-2025 (date only)
-        "%Y-%m-%d",               # 2025-09-30 (date only)
-    ]
-    
-    for fmt in formats:
+    for fmt in DT_FORMATS:
         try:
             # Parse the datetime string
             parsed_dt = datetime.strptime(dt_str.strip(), fmt)
@@ -191,10 +611,8 @@ def parse_datetime_string(dt_str: str) -> Optional[datetime]:
             if fmt.endswith("%Y") and not any(x in fmt for x in ["%H", "%I"]):
                 parsed_dt = parsed_dt.replace(hour=9, minute=0, second=0)
             
-            # Set timezone to CDT since telegram messages are in local time
-            from datetime import timezone, timedelta
-            cdt_tz = timezone(timedelta(hours=-5))  # CDT is UTC-5
-            return parsed_dt.replace(tzinfo=cdt_tz)
+            # Telegram messages are in Central local time
+            return to_central(parsed_dt)
             
         except ValueError:
             continue
@@ -202,8 +620,7 @@ def parse_datetime_string(dt_str: str) -> Optional[datetime]:
     # If no format matched, try to extract date and time components manually
     try:
         # Look for patterns like "09/30/2025 02:00 AM"
-        import re
-        date_time_match = re.search(r'(\d{1,2})[/-](\d{1,2})[/-](\d{4})\s+(\d{1,2}):(\d{2})\s*(AM|PM)?', dt_str, re.IGNORECASE)
+        date_time_match = RX_DT_LOOSE.search(dt_str)
         if date_time_match:
             month, day, year, hour, minute, ampm = date_time_match.groups()
             
@@ -217,18 +634,63 @@ def parse_datetime_string(dt_str: str) -> Optional[datetime]:
             elif ampm and ampm.upper() == 'AM' and hour == 12:
                 hour = 0
             
-            # Create datetime with CDT timezone since telegram messages are in local time
-            from datetime import timezone, timedelta
-            cdt_tz = timezone(timedelta(hours=-5))  # CDT is UTC-5
-            dt = datetime(year, month, day, hour, minute, 0, tzinfo=cdt_tz)
-            return dt
+            # Telegram messages are in Central local time
+            return to_central(datetime(year, month, day, hour, minute, 0))
     except Exception:
         pass
     
     # If all parsing attempts failed, return None
     return None
 
-def parse_bid(text: str) -> Optional[Dict]:
+def _sniff_datetime(s: str) -> Optional[datetime]:
+    """Build the datetime straight from a recognised shape, or None to defer to strptime."""
+    m = RX_DT_MDY.fullmatch(s) or RX_DT_YMD.fullmatch(s)
+    if not m:
+        return None
+    month, day = int(m.group("m")), int(m.group("d"))
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    if m.group("H") is None:
+        # Only the month-first date-only formats get the 9:00 AM default
+        hour = 9 if m.re is RX_DT_MDY else 0
+        minute = 0
+    else:
+        hour, minute = int(m.group("H")), int(m.group("M"))
+        if minute > 59:
+            return None
+        ampm = m.group("p")
+        if ampm:
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if ampm.upper() == "PM" else 0)
+        elif hour > 23:
+            return None
+    try:
+        return to_central(datetime(int(m.group("y")), month, day, hour, minute))
+    except ValueError:
+        return None
+
+@functools.lru_cache(maxsize=DT_CACHE_SIZE)
+def _parse_datetime_cached(dt_str: str) -> Optional[datetime]:
+    return _sniff_datetime(dt_str.strip()) or parse_datetime_string_strptime(dt_str)
+
+def parse_datetime_string(dt_str: str) -> Optional[datetime]:
+    """Parse datetime string in various formats and return it in America/Chicago.
+
+    Same results as parse_datetime_string_strptime; the common shapes are
+    recognised in one match and results are memoised per raw string, since
+    pickup/delivery times repeat heavily within a day.
+    """
+    if not dt_str:
+        return None
+    return _parse_datetime_cached(dt_str)
+
+def parse_bid_regex(text: str) -> Optional[Dict]:
+    """Reference parser: one multiline regex scan per field.
+
+    parse_bid() must return exactly what this returns; it also handles the
+    posts parse_bid hands back (keyword lines with nothing after them).
+    """
     if not text:
         return None
     s = text.strip()
@@ -290,64 +752,810 @@ def parse_bid(text: str) -> Optional[Dict]:
         "tag": tag,
     }
 
+# Line-anchored forms of the RX_* patterns, matched against a line with its
+# leading whitespace already stripped (same flags, so same Unicode semantics).
+LN_BID     = re.compile(r"New\s+Load\s+Bid:\s*(?P<bid>\d+)\s*$", re.I)
+LN_DIST    = re.compile(r"Distance:\s*(?P<miles>[\d,\.]+)\s*(?:mi|miles)?\s*$", re.I)
+LN_TAG     = re.compile(r"#(?P<tag>[A-Za-z0-9_-]+)\s*$", re.I)
+# Free-text fields only need their prefix: the value is the rest of the line, stripped
+LN_PICKUP  = re.compile(r"Pickup:", re.I)
+LN_DELIV   = re.compile(r"Delivery:", re.I)
+LN_STOP    = re.compile(r"Stop\s*\d+:", re.I)
+# A keyword with nothing after it on its line. The multiline RX_* patterns
+# keep matching on the following line(s) there, so defer to parse_bid_regex.
+LN_DANGLING = re.compile(r"(?:New(?:\s+Load(?:\s+Bid:)?)?|Distance:|Pickup:|Delivery:|Stop(?:\s*\d+:)?)\s*$", re.I)
+
+def parse_bid(text: str) -> Optional[Dict]:
+    """Single-pass bid parser: classify each line once by its first character."""
+    if not text:
+        return None
+    s = text.strip()
+
+    m_bid = m_dist = m_tag = None
+    pickup_str: Optional[str] = None
+    delivery_str: Optional[str] = None
+    stops: List[str] = []
+    # Lines only split on "\n": that is what ^/$ honour under re.M.
+    for line in s.split("\n"):
+        head = line.lstrip()
+        c = head[:1].casefold()  # casefold so e.g. U+017F still reaches the 's' branch like re.I does
+        if c == "s":
+            m = LN_STOP.match(head)
+            if m:
+                place = head[m.end():].strip()
+                if not place:
+                    return parse_bid_regex(text)
+                stops.append(place)
+                continue
+        elif c == "p":
+            if pickup_str is None:
+                m = LN_PICKUP.match(head)
+                if m:
+                    pickup_str = head[m.end():].strip()
+                    if not pickup_str:
+                        return parse_bid_regex(text)
+                    continue
+        elif c == "d":
+            if m_dist is None:
+                m_dist = LN_DIST.match(head)
+                if m_dist:
+                    continue
+            if delivery_str is None:
+                m = LN_DELIV.match(head)
+                if m:
+                    delivery_str = head[m.end():].strip()
+                    if not delivery_str:
+                        return parse_bid_regex(text)
+                    continue
+        elif c == "n":
+            if m_bid is None:
+                m_bid = LN_BID.match(head)
+                if m_bid:
+                    continue
+        elif c == "#":
+            if m_tag is None:
+                m_tag = LN_TAG.match(head)
+            continue
+        else:
+            continue
+        if LN_DANGLING.match(head):
+            return parse_bid_regex(text)
+
+    # Required: Bid #
+    if not m_bid:
+        return None
+    try:
+        bid_num = int(m_bid.group("bid"))
+    except Exception:
+        return None
+
+    # Optional: distance (allow commas)
+    miles: Optional[float] = None
+    if m_dist:
+        raw = m_dist.group("miles").replace(",", "")
+        try:
+            miles = float(raw)
+        except Exception:
+            miles = None
+
+    return {
+        "bid": bid_num,
+        "miles": miles,
+        "pickup_dt": pickup_str,
+        "delivery_dt": delivery_str,
+        "pickup_timestamp": parse_datetime_string(pickup_str) if pickup_str else None,
+        "delivery_timestamp": parse_datetime_string(delivery_str) if delivery_str else None,
+        "stops": stops,
+        "tag": m_tag.group("tag").upper() if m_tag else None,
+    }
+
 # ================= DB =================
-async def db_upsert_bid(d: Dict[str, Any]) -> None:
-    """Upsert into public.telegram_bids, ensuring JSON is sent as JSON."""
-    if not POSTGRES_ENABLED:
+DB_POOL: Optional[AsyncConnectionPool] = None
+
+def _db_pool_reconnect_failed(pool: AsyncConnectionPool) -> None:
+    # Called by psycopg_pool once reconnect_timeout elapses; the pool keeps
+    # trying in the background, so just surface it.
+    STATE["last_error"] = f"DB pool could not reconnect within {DB_POOL_RECONNECT_TIMEOUT:.0f}s"
+    push_event("DB pool reconnect failed; still retrying", "red")
+    log.error("DB pool reconnect failed after %.0fs", DB_POOL_RECONNECT_TIMEOUT)
+
+async def db_pool_open() -> None:
+    """Open the shared connection pool (called from post_init)."""
+    global DB_POOL
+    if not POSTGRES_ENABLED or DB_POOL is not None:
+        return
+    DB_POOL = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        reconnect_timeout=DB_POOL_RECONNECT_TIMEOUT,
+        reconnect_failed=_db_pool_reconnect_failed,
+        check=AsyncConnectionPool.check_connection,  # health check on checkout; broken conns are replaced
+        # Supabase pooler runs in transaction mode: server-side prepared
+        # statements don't survive across transactions there.
+        kwargs={"prepare_threshold": None},
+        name="nova-forwarder",
+        open=False,
+    )
+    await DB_POOL.open(wait=True, timeout=DB_POOL_TIMEOUT)
+    push_event(f"DB pool ready ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} conns)", "green")
+    log.info("DB pool opened (min=%s, max=%s)", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+
+async def db_pool_close() -> None:
+    """Close the shared connection pool (called from post_stop)."""
+    global DB_POOL
+    if DB_POOL is None:
+        return
+    pool, DB_POOL = DB_POOL, None
+    await pool.close()
+    log.info("DB pool closed")
+
+# Columns written per bid, in INSERT order
+BID_COLUMNS = (
+    "bid_number", "distance_miles", "pickup_timestamp", "delivery_timestamp",
+    "stops", "tag", "source_channel", "forwarded_to", "received_at", "expires_at",
+)
+# Columns an edit can change; received_at/expires_at (the 30-minute window)
+# are set when the bid is first stored and only reset by a re-post after it closed
+BID_CONTENT_COLUMNS = (
+    "distance_miles", "pickup_timestamp", "delivery_timestamp",
+    "stops", "tag", "source_channel", "forwarded_to",
+)
+_BID_ROW_SQL = "(" + ", ".join(["%s"] * len(BID_COLUMNS)) + ")"
+_BID_UPSERT_HEAD = (
+    "insert into public.telegram_bids as t (" + ", ".join(BID_COLUMNS) + ") values "
+)
+# A conflicting row is only rewritten when its content changed or its window
+# closed (a re-post); otherwise the statement is a no-op for it and it is not
+# returned. received_at coming back equal to ours means this write (re)opened
+# the window, i.e. the bid needs a notification.
+_BID_REOPEN_SQL = "(t.expires_at is null or t.expires_at <= excluded.received_at)"
+_BID_UPSERT_TAIL = """
+    on conflict (bid_number) do update set
+      distance_miles     = excluded.distance_miles,
+      pickup_timestamp   = excluded.pickup_timestamp,
+      delivery_timestamp = excluded.delivery_timestamp,
+      stops              = excluded.stops,
+      tag                = excluded.tag,
+      source_channel     = excluded.source_channel,
+      forwarded_to       = excluded.forwarded_to,
+      received_at        = case when {reopen} then excluded.received_at else t.received_at end,
+      expires_at         = case when {reopen} then excluded.expires_at else t.expires_at end
+    where {reopen}
+       or ({t_cols}) is distinct from ({x_cols})
+    returning t.bid_number, t.received_at, t.expires_at
+""".format(
+    reopen=_BID_REOPEN_SQL,
+    t_cols=", ".join("t." + c for c in BID_CONTENT_COLUMNS),
+    x_cols=", ".join("excluded." + c for c in BID_CONTENT_COLUMNS),
+)
+
+def _bid_row(d: Dict[str, Any]) -> tuple:
+    return (
+        d.get("bid_number"),
+        d.get("distance_miles"),
+        d.get("pickup_timestamp"),
+        d.get("delivery_timestamp"),
+        Json(d.get("stops") or []),  # <- wrap as JSON explicitly
+        d.get("tag"),
+        d.get("source_channel"),
+        d.get("forwarded_to"),
+        d.get("received_at"),
+        d.get("expires_at"),
+    )
+
+# bid_number -> (content fingerprint, expires_at) as last committed, most recent last
+BID_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+
+def bid_fingerprint(d: Dict[str, Any]) -> tuple:
+    return tuple(tuple(v) if isinstance(v, list) else v for v in (d.get(c) for c in BID_CONTENT_COLUMNS))
+
+def _bid_cache_put(bid_number: str, fingerprint: tuple, expires_at: Optional[datetime]) -> None:
+    BID_CACHE[bid_number] = (fingerprint, expires_at)
+    BID_CACHE.move_to_end(bid_number)
+    while len(BID_CACHE) > BID_CACHE_SIZE:
+        BID_CACHE.popitem(last=False)
+
+# ================= WEBHOOK =================
+# One keep-alive client for the app's lifetime instead of a TLS handshake per bid
+HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+async def http_client_open() -> None:
+    """Create the shared webhook client (called from post_init)."""
+    global HTTP_CLIENT
+    if not WEBHOOK_URL or HTTP_CLIENT is not None:
+        return
+    http2 = WEBHOOK_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401  (httpx needs it for HTTP/2)
+        except ImportError:
+            log.warning("WEBHOOK_HTTP2 set but 'h2' is not installed; using HTTP/1.1")
+            http2 = False
+    headers = {"Content-Type": "application/json"}
+    if WEBHOOK_API_KEY:
+        headers["x-webhook-key"] = WEBHOOK_API_KEY
+    HTTP_CLIENT = httpx.AsyncClient(
+        timeout=WEBHOOK_TIMEOUT,
+        http2=http2,
+        headers=headers,
+        limits=httpx.Limits(
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            max_keepalive_connections=WEBHOOK_MAX_CONNECTIONS,
+            keepalive_expiry=60.0,
+        ),
+    )
+    log.info("Webhook client ready (http2=%s, batch=%sms)", http2, WEBHOOK_BATCH_MS)
+
+async def http_client_close() -> None:
+    """Close the webhook client (called from post_stop)."""
+    global HTTP_CLIENT
+    if HTTP_CLIENT is None:
         return
+    client, HTTP_CLIENT = HTTP_CLIENT, None
+    await client.aclose()
+
+async def _post_webhook(bid_numbers: List[str], idempotency_keys: List[str]) -> Optional[str]:
+    """POST one notification call; returns None when the app accepted it, else the error."""
+    label = bid_numbers[0] if len(bid_numbers) == 1 else f"{len(bid_numbers)} bids"
     try:
-        async with await psycopg.AsyncConnection.connect(DATABASE_URL) as conn:
-            async with conn.cursor(row_factory=dict_row) as cur:
-                payload = {
-                    "bid_number": d.get("bid_number"),
-                    "distance_miles": d.get("distance_miles"),
-                    "pickup_timestamp": d.get("pickup_timestamp"),
-                    "delivery_timestamp": d.get("delivery_timestamp"),
-                    "stops": Json(d.get("stops") or []),  # <- wrap as JSON explicitly
-                    "tag": d.get("tag"),
-                    "source_channel": d.get("source_channel"),
-                    "forwarded_to": d.get("forwarded_to"),
-                    "received_at": d.get("received_at"),
-                    "expires_at": d.get("expires_at"),
-                }
+        if HTTP_CLIENT is None:
+            raise RuntimeError("webhook client is not open")
+        if len(bid_numbers) == 1:
+            payload = {"bidNumber": bid_numbers[0], "idempotencyKey": idempotency_keys[0]}
+        else:
+            payload = {"bidNumbers": bid_numbers, "idempotencyKeys": idempotency_keys}
+        started = time.perf_counter()
+        try:
+            response = await HTTP_CLIENT.post(
+                WEBHOOK_URL, json=payload, headers={"Idempotency-Key": ",".join(idempotency_keys)},
+            )
+        except Exception:
+            M_WEBHOOK_SECONDS.labels("error").observe(time.perf_counter() - started)
+            raise
+        M_WEBHOOK_SECONDS.labels("ok" if response.status_code == 200 else "http_error").observe(
+            time.perf_counter() - started)
+        
+        if response.status_code == 200:
+            push_event(f"Triggered notifications for bid {label}", "cyan")
+            log.info("Triggered notifications for bid(s) %s", ", ".join(bid_numbers))
+            return None
+        M_ERRORS.labels("webhook").inc()
+        push_event(f"Notification trigger failed: {response.status_code}", "yellow")
+        log.warning("Notification trigger failed for bid(s) %s: %s", ", ".join(bid_numbers), response.status_code)
+        return f"HTTP {response.status_code}"
+    except Exception as webhook_error:
+        M_ERRORS.labels("webhook").inc()
+        push_event(f"Webhook error (will retry): {str(webhook_error)[:50]}", "yellow")
+        log.warning("Webhook error for bid(s) %s (will retry): %s", ", ".join(bid_numbers), webhook_error)
+        return str(webhook_error) or type(webhook_error).__name__
+
+# ================= OUTBOX =================
+# Upserts write a pending row to telegram_bid_notification_outbox in the same
+# transaction; this dispatcher delivers them off the ingest path with retries.
+OUTBOX_ENABLED = bool(WEBHOOK_URL) and POSTGRES_ENABLED
+OUTBOX_TASK: Optional["asyncio.Task[None]"] = None
+_OUTBOX_WAKE: Optional[asyncio.Event] = None
+
+_OUTBOX_INSERT_SQL = """
+    insert into public.telegram_bid_notification_outbox (bid_number, idempotency_key)
+    values {rows}
+    on conflict (idempotency_key) do nothing
+"""
+# Lease due rows by pushing next_attempt_at forward; a crashed dispatcher's
+# rows simply become due again once the lease runs out.
+_OUTBOX_CLAIM_SQL = """
+    update public.telegram_bid_notification_outbox o
+       set attempts = o.attempts + 1,
+           next_attempt_at = now() + make_interval(secs => %(lease)s)
+     where o.id in (
+           select id from public.telegram_bid_notification_outbox
+            where status = 'pending' and next_attempt_at <= now()
+            order by id
+            limit %(limit)s
+            for update skip locked)
+    returning o.id, o.bid_number, o.idempotency_key, o.attempts
+"""
+
+def outbox_key(d: Dict[str, Any]) -> str:
+    """Idempotency key for one stored bid window (a re-post after the window closed gets a new key)."""
+    received_at = d.get("received_at")
+    stamp = received_at.isoformat() if isinstance(received_at, datetime) else str(received_at)
+    return f"{d.get('bid_number')}:{stamp}"
+
+def _outbox_backoff(attempts: int) -> float:
+    delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+def outbox_wake() -> None:
+    if _OUTBOX_WAKE is not None:
+        _OUTBOX_WAKE.set()
+
+async def _outbox_finish(delivered: List[Dict[str, Any]], failed: List[Dict[str, Any]]) -> None:
+    async with DB_POOL.connection() as conn:
+        async with conn.cursor() as cur:
+            if delivered:
                 await cur.execute(
-                    """
-                    insert into public.telegram_bids
-                      (bid_number, distance_miles, pickup_timestamp, delivery_timestamp,
-                       stops, tag, source_channel, forwarded_to, received_at, expires_at)
-                    values
-                      (%(bid_number)s, %(distance_miles)s, %(pickup_timestamp)s, %(delivery_timestamp)s,
-                       %(stops)s, %(tag)s, %(source_channel)s, %(forwarded_to)s, %(received_at)s, %(expires_at)s)
-                    on conflict (bid_number) do update set
-                      distance_miles     = excluded.distance_miles,
-                      pickup_timestamp   = excluded.pickup_timestamp,
-                      delivery_timestamp = excluded.delivery_timestamp,
-                      stops              = excluded.stops,
-                      tag                = excluded.tag,
-                      source_channel     = excluded.source_channel,
-                      forwarded_to       = excluded.forwarded_to,
-                      received_at        = excluded.received_at,
-                      expires_at         = excluded.expires_at
-                    """,
-                    payload,
+                    "update public.telegram_bid_notification_outbox "
+                    "set status = 'delivered', delivered_at = now(), last_error = null "
+                    "where id = any(%s)",
+                    ([r["id"] for r in delivered],),
                 )
-            await conn.commit()
-        push_event(f"Upserted bid {d.get('bid_number')}", "green")
-        log.info("Upserted bid %s", d.get("bid_number"))
+            for r in failed:
+                give_up = r["attempts"] >= OUTBOX_MAX_ATTEMPTS
+                await cur.execute(
+                    "update public.telegram_bid_notification_outbox "
+                    "set status = %s, next_attempt_at = now() + make_interval(secs => %s), last_error = %s "
+                    "where id = %s",
+                    ("failed" if give_up else "pending", _outbox_backoff(r["attempts"]),
+                     r.get("error") or "delivery failed", r["id"]),
+                )
+                if give_up:
+                    STATE["last_error"] = f"Notification for bid {r['bid_number']} failed after {r['attempts']} attempts"
+                    push_event(f"Gave up notifying bid {r['bid_number']}", "red")
+                    log.error("Outbox row %s (bid %s) failed after %s attempts", r["id"], r["bid_number"], r["attempts"])
+
+# One pass claims only what it sends at once (OUTBOX_CONCURRENCY calls, or one batched
+# call), so the whole pass fits in the lease of a single call (connect + response timeouts)
+# and no other dispatcher re-claims rows that are still in flight.
+OUTBOX_LEASE_SECONDS = WEBHOOK_TIMEOUT * 2 + 5
+
+def outbox_claim_size() -> int:
+    per_pass = WEBHOOK_BATCH_MAX if WEBHOOK_BATCH_MS > 0 else OUTBOX_CONCURRENCY
+    return max(1, min(OUTBOX_CLAIM_LIMIT, per_pass))
+
+async def outbox_dispatch_once() -> int:
+    """Claim due rows, deliver them, record the outcome. Returns rows claimed."""
+    async with DB_POOL.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(_OUTBOX_CLAIM_SQL, {"lease": OUTBOX_LEASE_SECONDS, "limit": outbox_claim_size()})
+            rows = await cur.fetchall()
+    if not rows:
+        return 0
+
+    delivered: List[Dict[str, Any]] = []
+    failed: List[Dict[str, Any]] = []
+    if WEBHOOK_BATCH_MS > 0:
+        # Batched mode: the whole claim goes out as one bidNumbers call
+        sent_ns = time.time_ns()
+        error = await _post_webhook([r["bid_number"] for r in rows], [r["idempotency_key"] for r in rows])
+        answered_ns = time.time_ns()
+        for r in rows:
+            r["error"] = error
+            r["_sent_ns"] = (sent_ns, answered_ns)
+        (failed if error else delivered).extend(rows)
+    else:
+        async def _one(r: Dict[str, Any]) -> None:
+            sent_ns = time.time_ns()
+            r["error"] = await _post_webhook([r["bid_number"]], [r["idempotency_key"]])
+            r["_sent_ns"] = (sent_ns, time.time_ns())
+            (failed if r["error"] else delivered).append(r)
+        await asyncio.gather(*(_one(r) for r in rows))
+    await _outbox_finish(delivered, failed)
+    _trace_webhook(rows)
+    return len(rows)
+
+async def outbox_dispatcher() -> None:
+    last_cleanup = 0.0
+    while True:
+        try:
+            await asyncio.wait_for(_OUTBOX_WAKE.wait(), OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _OUTBOX_WAKE.clear()
+        if WEBHOOK_BATCH_MS > 0:
+            # Let the rest of a burst land so it goes out in one call
+            await asyncio.sleep(WEBHOOK_BATCH_MS / 1000.0)
+        try:
+            while await outbox_dispatch_once() >= outbox_claim_size():
+                pass
+            if time.monotonic() - last_cleanup > 3600:
+                async with DB_POOL.connection() as conn:
+                    await conn.execute(
+                        "delete from public.telegram_bid_notification_outbox "
+                        "where status = 'delivered' and delivered_at < now() - make_interval(days => %s)",
+                        (OUTBOX_RETENTION_DAYS,),
+                    )
+                last_cleanup = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            M_ERRORS.labels("outbox").inc()
+            STATE["last_error"] = f"Outbox dispatch failed: {e}"
+            push_event(f"Outbox dispatch failed: {str(e)[:60]}", "red")
+            log.exception("Outbox dispatch failed")
+
+async def outbox_start() -> None:
+    global OUTBOX_TASK, _OUTBOX_WAKE
+    if not OUTBOX_ENABLED or OUTBOX_TASK is not None:
+        return
+    _OUTBOX_WAKE = asyncio.Event()
+    _OUTBOX_WAKE.set()  # deliver anything left over from the last run
+    OUTBOX_TASK = asyncio.create_task(outbox_dispatcher(), name="outbox-dispatcher")
+
+async def outbox_stop() -> None:
+    """Give the dispatcher one last pass, then stop it. Undelivered rows stay pending."""
+    global OUTBOX_TASK, _OUTBOX_WAKE
+    if OUTBOX_TASK is None:
+        return
+    try:
+        await asyncio.wait_for(outbox_dispatch_once(), WEBHOOK_TIMEOUT + 1)
     except Exception as e:
+        log.warning("Final outbox pass failed: %s", e)
+    OUTBOX_TASK.cancel()
+    try:
+        await OUTBOX_TASK
+    except asyncio.CancelledError:
+        pass
+    OUTBOX_TASK, _OUTBOX_WAKE = None, None
+
+def _note_bid_window(received_at: Optional[datetime]) -> None:
+    """Move STATE["last_bid_at"] to a bid whose 30-minute window (re)started."""
+    last_at = STATE["last_bid_at"]
+    if received_at is not None and (last_at is None or received_at > last_at):
+        STATE["last_bid_at"] = received_at
+
+async def db_upsert_bids(records: List[Dict[str, Any]]) -> bool:
+    """Write a batch into public.telegram_bids, touching only bids that changed.
+
+    Bids whose last committed fields (BID_CACHE) match are skipped without a
+    round trip; known bids that changed get an UPDATE of just the changed
+    columns; everything else goes through one multi-row insert ... on conflict.
+    Only new (or re-posted after their window closed) bids get an outbox row.
+    Returns False if the batch was not stored (the error is logged and shown).
+    """
+    if not POSTGRES_ENABLED or not records:
+        return True
+    # A single INSERT ... ON CONFLICT can't touch the same row twice, so keep
+    # only the latest record per bid (edits arriving in the same batch).
+    latest: Dict[str, Dict[str, Any]] = {}
+    for d in records:
+        latest.pop(d.get("bid_number"), None)
+        latest[d.get("bid_number")] = d
+    batch = list(latest.values())
+    started_ns = time.time_ns()
+
+    outcomes: Dict[str, str] = {}  # bid_number -> new / updated / unchanged
+    fingerprints: Dict[str, tuple] = {}
+    changed_cols: Dict[str, List[str]] = {}
+    updates: List[Dict[str, Any]] = []
+    fresh: List[Dict[str, Any]] = []
+    for d in batch:
+        bid_number = d.get("bid_number")
+        fp = fingerprints[bid_number] = bid_fingerprint(d)
+        cached = BID_CACHE.get(bid_number)
+        if cached is None or cached[1] is None or cached[1] <= d.get("received_at"):
+            fresh.append(d)  # unknown here, or a re-post after the window closed
+            continue
+        cols = [c for c, old, new in zip(BID_CONTENT_COLUMNS, cached[0], fp) if old != new]
+        if cols:
+            changed_cols[bid_number] = cols
+            updates.append(d)
+        else:
+            outcomes[bid_number] = "unchanged"
+            BID_CACHE.move_to_end(bid_number)
+
+    try:
+        if updates or fresh:
+            if DB_POOL is None:
+                raise RuntimeError("DB pool is not open")
+            started = time.perf_counter()
+            returned: Dict[str, Dict[str, Any]] = {}
+            unreturned: List[str] = []  # stored already with these fields (not in BID_CACHE)
+            stored_expiry: Dict[str, Optional[datetime]] = {}
+            notify: List[Dict[str, Any]] = []
+            # The pool's connection context commits on clean exit and rolls back on error
+            async with DB_POOL.connection() as conn:
+                async with conn.cursor(row_factory=dict_row) as cur:
+                    for d in updates:
+                        bid_number = d["bid_number"]
+                        row = dict(zip(BID_COLUMNS, _bid_row(d)))
+                        cols = changed_cols[bid_number]
+                        await cur.execute(
+                            "update public.telegram_bids set " + ", ".join(f"{c} = %s" for c in cols)
+                            + " where bid_number = %s",
+                            [row[c] for c in cols] + [bid_number],
+                        )
+                        if cur.rowcount:
+                            outcomes[bid_number] = "updated"
+                        else:
+                            fresh.append(d)  # row went away underneath us: store it again
+                    if fresh:
+                        params: List[Any] = []
+                        for d in fresh:
+                            params.extend(_bid_row(d))
+                        await cur.execute(
+                            _BID_UPSERT_HEAD + ", ".join([_BID_ROW_SQL] * len(fresh)) + _BID_UPSERT_TAIL, params)
+                        returned = {r["bid_number"]: r for r in await cur.fetchall()}
+                        for d in fresh:
+                            r = returned.get(d["bid_number"])
+                            if r is None:
+                                outcomes[d["bid_number"]] = "unchanged"
+                                unreturned.append(d["bid_number"])
+                            elif r["received_at"] == d.get("received_at"):
+                                outcomes[d["bid_number"]] = "new"
+                                notify.append(d)
+                            else:
+                                outcomes[d["bid_number"]] = "updated"
+                    if unreturned:
+                        # The upsert skips rows it leaves as they are; fetch their window so
+                        # the next duplicate is answered from BID_CACHE
+                        await cur.execute(
+                            "select bid_number, expires_at from public.telegram_bids where bid_number = any(%s)",
+                            [unreturned],
+                        )
+                        stored_expiry = {r["bid_number"]: r["expires_at"] for r in await cur.fetchall()}
+                    if OUTBOX_ENABLED and notify:
+                        # Same transaction: the notification exists iff the bid does
+                        await cur.execute(
+                            _OUTBOX_INSERT_SQL.format(rows=", ".join(["(%s, %s)"] * len(notify))),
+                            [v for d in notify for v in (d.get("bid_number"), outbox_key(d))],
+                        )
+            M_DB_UPSERT_SECONDS.observe(time.perf_counter() - started)
+            M_DB_UPSERT_ROWS.observe(len(updates) + len(fresh))
+            STATE["db_batches"] += 1
+
+            # Committed: remember what is stored now
+            for d in batch:
+                bid_number = d["bid_number"]
+                if bid_number in returned:
+                    _bid_cache_put(bid_number, fingerprints[bid_number], returned[bid_number]["expires_at"])
+                elif outcomes.get(bid_number) == "updated":
+                    _bid_cache_put(bid_number, fingerprints[bid_number], BID_CACHE[bid_number][1])
+                elif bid_number in stored_expiry:
+                    _bid_cache_put(bid_number, fingerprints[bid_number], stored_expiry[bid_number])
+            if notify:
+                # Notification rows are committed; let the dispatcher deliver them
+                outbox_wake()
+
+        _trace_upsert(records, latest, len(updates) + len(fresh), started_ns, outcomes=outcomes)
+        by_outcome: Dict[str, List[str]] = {}
+        for bid_number, outcome in outcomes.items():
+            M_BID_WRITES.labels(outcome).inc()
+            by_outcome.setdefault(outcome, []).append(bid_number)
+        new, updated, unchanged = (by_outcome.get(k, []) for k in ("new", "updated", "unchanged"))
+        for bid_number in new:
+            # Edits and duplicates don't restart the window, so they don't move the countdown
+            _note_bid_window(latest[bid_number].get("received_at"))
+        if len(new) == 1:
+            push_event(f"Upserted bid {new[0]}", "green")
+        elif new:
+            push_event(f"Upserted {len(new)} bids (last {new[-1]})", "green")
+        for bid_number in updated:
+            cols = changed_cols.get(bid_number)
+            push_event(f"Bid updated {bid_number}" + (f" ({', '.join(cols)})" if cols else ""), "magenta")
+        if unchanged:
+            push_event(f"Bid {unchanged[-1]} unchanged; write skipped" if len(unchanged) == 1
+                       else f"{len(unchanged)} bids unchanged; writes skipped", "dim")
+        log.info("Bid writes: %d new, %d updated, %d unchanged%s", len(new), len(updated), len(unchanged),
+                 f" ({', '.join(new + updated)})" if new or updated else "")
+    except Exception as e:
+        M_ERRORS.labels("db_upsert").inc()
+        _trace_upsert(records, latest, len(updates) + len(fresh), started_ns, str(e) or type(e).__name__)
         db_info = parse_database_url(DATABASE_URL)
         hostname = db_info.get('host', 'unknown')
         STATE["last_error"] = f"DB upsert failed (host: {hostname}): {e}"
         push_event(f"DB upsert failed (host: {hostname}): {e}", "red")
         log.exception("DB upsert failed - host: %s", hostname)
+        return False
+    return True
+
+async def db_upsert_bid(d: Dict[str, Any]) -> bool:
+    """Upsert a single record (bypasses the ingest queue)."""
+    return await db_upsert_bids([d])
+
+def renormalize_stored_timestamps(before: datetime, since: Optional[datetime] = None,
+                                  dry_run: bool = False, batch_size: int = 500) -> int:
+    """Re-stamp pickup/delivery times stored with the old fixed UTC-5 offset.
+
+    Rows received before ``before`` (the deploy time of DST-aware parsing)
+    have their wall-clock times re-read as America/Chicago. Rows received
+    later are already correct and must not be touched, so ``before`` is
+    required. Returns the number of rows changed (or that would change).
+    """
+    select_sql = """
+        select bid_number, pickup_timestamp, delivery_timestamp
+          from public.telegram_bids
+         where source_channel is not null
+           and received_at < %(before)s
+           and (%(since)s::timestamptz is null or received_at >= %(since)s)
+           and (pickup_timestamp is not null or delivery_timestamp is not null)
+           and bid_number > %(after)s
+         order by bid_number
+         limit %(limit)s
+    """
+    update_sql = """
+        update public.telegram_bids
+           set pickup_timestamp = %s, delivery_timestamp = %s
+         where bid_number = %s
+    """
+
+    def _fix(ts: Optional[datetime]) -> Optional[datetime]:
+        if ts is None:
+            return None
+        return to_central(ts.astimezone(LEGACY_CDT_TZ).replace(tzinfo=None))
+
+    changed = scanned = 0
+    after = ""
+    with psycopg.connect(DATABASE_URL, prepare_threshold=None) as conn:
+        while True:
+            rows = conn.execute(select_sql, {"before": before, "since": since, "after": after,
+                                             "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            updates = []
+            for bid_number, pickup, delivery in rows:
+                new_pickup, new_delivery = _fix(pickup), _fix(delivery)
+                if new_pickup != pickup or new_delivery != delivery:
+                    updates.append((new_pickup, new_delivery, bid_number))
+            scanned += len(rows)
+            changed += len(updates)
+            after = rows[-1][0]
+            if updates and not dry_run:
+                with conn.cursor() as cur:
+                    cur.executemany(update_sql, updates)
+                conn.commit()
+            log.info("Re-normalized %d/%d rows so far (through bid %s)", changed, scanned, after)
+    return changed
+
+# ============== INGEST PIPELINE ==============
+# Handler -> bounded queue -> writer task that flushes multi-row upserts on
+# size or on a short latency deadline, whichever comes first.
+INGEST_QUEUE: Optional["asyncio.Queue[Dict[str, Any]]"] = None
+INGEST_WRITER: Optional["asyncio.Task[None]"] = None
+
+def _update_queue_depth() -> None:
+    depth = INGEST_QUEUE.qsize() if INGEST_QUEUE is not None else 0
+    STATE["queue_depth"] = depth
+    if depth > STATE["queue_peak"]:
+        STATE["queue_peak"] = depth
+
+async def enqueue_bid(record: Dict[str, Any]) -> None:
+    """Hand a parsed record to the writer; waits (backpressure) when the queue is full."""
+    if INGEST_QUEUE is None:
+        # Pipeline not running (e.g. during shutdown): write through
+        await db_upsert_bid(record)
+        return
+    if "_trace" in record:
+        record["_queued_ns"] = time.time_ns()
+    if INGEST_QUEUE.full():
+        push_event(f"Ingest queue full ({INGEST_QUEUE_MAXSIZE}); waiting on DB", "yellow")
+        log.warning("Ingest queue full (%d); applying backpressure", INGEST_QUEUE_MAXSIZE)
+    await INGEST_QUEUE.put(record)
+    _update_queue_depth()
+
+async def ingest_writer() -> None:
+    loop = asyncio.get_running_loop()
+    q = INGEST_QUEUE
+    while True:
+        batch = [await q.get()]
+        deadline = loop.time() + INGEST_FLUSH_MS / 1000.0
+        while len(batch) < INGEST_BATCH_SIZE:
+            try:
+                batch.append(q.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(q.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        _update_queue_depth()
+        try:
+            await db_upsert_bids(batch)
+        finally:
+            for _ in batch:
+                q.task_done()
+
+async def ingest_start() -> None:
+    global INGEST_QUEUE, INGEST_WRITER
+    if not POSTGRES_ENABLED or INGEST_WRITER is not None:
+        return
+    INGEST_QUEUE = asyncio.Queue(maxsize=INGEST_QUEUE_MAXSIZE)
+    INGEST_WRITER = asyncio.create_task(ingest_writer(), name="ingest-writer")
+    log.info("Ingest pipeline started (batch=%d, flush=%dms, queue=%d)",
+             INGEST_BATCH_SIZE, INGEST_FLUSH_MS, INGEST_QUEUE_MAXSIZE)
+
+async def ingest_stop(timeout: Optional[float] = 10.0) -> None:
+    """Flush whatever is queued (no time limit if timeout is None), then stop the writer."""
+    global INGEST_QUEUE, INGEST_WRITER
+    if INGEST_WRITER is None:
+        return
+    try:
+        await asyncio.wait_for(INGEST_QUEUE.join(), timeout)
+    except asyncio.TimeoutError:
+        log.warning("Ingest queue not drained on shutdown (%d left)", INGEST_QUEUE.qsize())
+    INGEST_WRITER.cancel()
+    try:
+        await INGEST_WRITER
+    except asyncio.CancelledError:
+        pass
+    INGEST_QUEUE, INGEST_WRITER = None, None
+    _update_queue_depth()
+
+# ============== FORWARD SCHEDULER ==============
+# copy_message calls go through forward_scheduler.ForwardScheduler: one
+# ordered queue per target chat under Telegram's flood limits. RetryAfter
+# pauses the chat and retries the same post (never dropped); plain network
+# errors retry with backoff; BadRequest (post deleted etc.) is final, and a
+# timed-out attempt is not retried because Telegram may have sent it anyway.
+FORWARDER: Optional[ForwardScheduler] = None
+
+def _forward_retry_delay(e: BaseException, attempt: int) -> Optional[float]:
+    if isinstance(e, RetryAfter):
+        retry_after = e.retry_after
+        seconds = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+        M_FORWARD_RETRIES.labels("retry_after").inc()
+        push_event(f"Flood control: forwards paused {seconds:.0f}s", "yellow")
+        log.warning("Flood control on copy_message; retrying in %.0fs", seconds)
+        return seconds + 0.5
+    if isinstance(e, (TimedOut, BadRequest, asyncio.TimeoutError)) or not isinstance(e, NetworkError):
+        return None
+    if attempt >= FORWARD_MAX_ATTEMPTS:
+        return None
+    M_FORWARD_RETRIES.labels("network").inc()
+    delay = min(30.0, 2.0 ** attempt)
+    log.warning("copy_message failed (%s); retry %d in %.0fs", e, attempt, delay)
+    return delay
+
+def _update_forward_backlog(backlog: int) -> None:
+    if STATE["forward_backlog"] != backlog:
+        STATE["forward_backlog"] = backlog
+
+def forward_start(bot) -> None:
+    global FORWARDER
+    if FORWARDER is not None:
+        return
+    FORWARDER = ForwardScheduler(
+        functools.partial(forward_post, bot),
+        _forward_retry_delay,
+        chat_per_minute=FORWARD_CHAT_PER_MINUTE,
+        chat_burst=FORWARD_CHAT_BURST,
+        chat_min_interval=FORWARD_CHAT_MIN_INTERVAL,
+        global_per_second=FORWARD_GLOBAL_PER_SECOND,
+        on_backlog=_update_forward_backlog,
+    )
+    FORWARDER.start()
+
+async def forward_stop() -> None:
+    """Give queued forwards FORWARD_DRAIN_TIMEOUT to go out, then drop the rest (they are in the ingest log)."""
+    global FORWARDER
+    if FORWARDER is None:
+        return
+    left = await FORWARDER.stop(FORWARD_DRAIN_TIMEOUT)
+    if left:
+        push_event(f"Shutdown: {left} forwards not sent", "red")
+    FORWARDER = None
 
 # ============== UI (fixed-height, stable) ==============
+# Sub-panels are rebuilt only when their inputs change; ui_thread redraws
+# only when STATE was written or the countdown's second ticked.
+_PANEL_CACHE: Dict[str, tuple] = {}
+
+def _cached(name: str, key: Any, build) -> Any:
+    hit = _PANEL_CACHE.get(name)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    renderable = build()
+    _PANEL_CACHE[name] = (key, renderable)
+    return renderable
+
 def _stat_row(label: str, value: str, value_style: str = "bold") -> Text:
     t = Text.assemble((f"{label}: ", "dim"), (value, value_style))
     return t
 
+def _since_last_bid(now: datetime) -> Optional[int]:
+    """Whole seconds since the last bid (the countdown's tick), or None."""
+    last_at = STATE["last_bid_at"]
+    return int((now - last_at).total_seconds()) if last_at else None
+
 def _events_panel() -> Panel:
-    rows = list(STATE["events"])[:10]
+    rows = [(f"[{ts}] {txt}", style) for _, ts, txt, style in list(STATE["events"])[:10]]
     rows += [(" ", "dim")] * max(0, 10 - len(rows))
     tbl = Table.grid(expand=True)
     tbl.add_column()
@@ -355,16 +1563,14 @@ def _events_panel() -> Panel:
         tbl.add_row(Text(msg, style=style))
     return Panel(tbl, title="Recent Events", border_style="blue")
 
-def _window_panel() -> Panel:
-    now = datetime.now(timezone.utc)
-    last_at = STATE["last_bid_at"]
+def _window_panel(since: Optional[int]) -> Panel:
     width = 48
-    if not last_at:
+    if since is None:
         bar = "░" * width
         text = Text.assemble(("Window ", "dim"), (bar, "grey50"), (f"  0/{WINDOW_SECONDS}s  30:00", "dim"))
         return Panel(Align.center(text), title="30-min Window", border_style="blue")
 
-    elapsed = int(max(0, min(WINDOW_SECONDS, (now - last_at).total_seconds())))
+    elapsed = max(0, min(WINDOW_SECONDS, since))
     remain = WINDOW_SECONDS - elapsed
     filled = int(width * (elapsed / WINDOW_SECONDS))
     bar = "█" * filled + "░" * (width - filled)
@@ -372,19 +1578,26 @@ def _window_panel() -> Panel:
     text = Text.assemble(("Window ", "dim"), (bar, "cyan"), (f"  {elapsed}/{WINDOW_SECONDS}s  {clock}", "dim"))
     return Panel(Align.center(text), title="30-min Window", border_style="blue")
 
-def render_ui() -> Panel:
+def _stats_table() -> Table:
     connected = STATE["connected"]
-    title = Text("NOVA • Telegram Forwarder", style="bold cyan")
-
     top = Table.grid(expand=True)
     top.add_column(ratio=1)
     top.add_column(ratio=1, justify="right")
 
     left = Table.grid()
-    left.add_row(_stat_row("Status", "CONNECTED" if connected else "DISCONNECTED",
-                           "bold green" if connected else "bold red"))
-    left.add_row(_stat_row("Source", f"{SOURCE_CHAT_ID}"))
-    left.add_row(_stat_row("Target", f"{TARGET_CHAT_ID}"))
+    if STATE["role"] == "standby":
+        left.add_row(_stat_row("Status", "STANDBY", "bold yellow"))
+    else:
+        left.add_row(_stat_row("Status", "CONNECTED" if connected else "DISCONNECTED",
+                               "bold green" if connected else "bold red"))
+    routes = list(ROUTES.values())
+    if len(routes) == 1:
+        route = routes[0]
+        left.add_row(_stat_row("Source", f"{route.source}"))
+        left.add_row(_stat_row("Target", ", ".join(map(str, route.targets))))
+    else:
+        for route in routes:
+            left.add_row(_stat_row(route.name, f"{route.posts} posts / {route.bids} bids / {route.forwarded} fwd"))
 
     right = Table.grid()
     right.add_row(_stat_row("Forwarded", str(STATE["forwarded_count"])))
@@ -393,133 +1606,1031 @@ def render_ui() -> Panel:
     last_tag = STATE["last_tag"] or "—"
     right.add_row(_stat_row("Last Bid #", last_bid))
     right.add_row(_stat_row("Last Tag", last_tag))
+    right.add_row(_stat_row("Queue", f"{STATE['queue_depth']} (peak {STATE['queue_peak']})",
+                            "bold yellow" if STATE["queue_depth"] else "bold"))
+    right.add_row(_stat_row("Fwd Backlog", str(STATE["forward_backlog"]),
+                            "bold yellow" if STATE["forward_backlog"] else "bold"))
     top.add_row(left, right)
+    return top
 
-    if STATE["last_bid_at"]:
-        now = datetime.now(timezone.utc)
-        since = now - STATE["last_bid_at"]
-        since_human = humanize.naturaldelta(since) if since.total_seconds() >= 1 else "just now"
-        since_clock = f"{int(since.total_seconds()//60):02d}:{int(since.total_seconds()%60):02d}"
-        timers = _stat_row("Since Last Bid", f"{since_human} ({since_clock})")
-    else:
-        timers = _stat_row("Since Last Bid", "—")
+def _timers_row(since: Optional[int]) -> Text:
+    if since is None:
+        return _stat_row("Since Last Bid", "—")
+    since_human = humanize.naturaldelta(timedelta(seconds=since)) if since >= 1 else "just now"
+    since_clock = f"{since//60:02d}:{since%60:02d}"
+    return _stat_row("Since Last Bid", f"{since_human} ({since_clock})")
 
+def render_ui() -> Panel:
+    since = _since_last_bid(datetime.now(timezone.utc))
+    stats_key = tuple(STATE[k] for k in ("connected", "forwarded_count", "parsed_count", "last_bid_seen",
+                                         "last_tag", "queue_depth", "queue_peak", "forward_backlog", "role")) + \
+        tuple((r.posts, r.bids, r.forwarded) for r in list(ROUTES.values()))
     group = Group(
-        Align.center(title),
+        _cached("title", None, lambda: Align.center(Text("NOVA • Telegram Forwarder", style="bold cyan"))),
         Rule(style="cyan"),
-        top,
+        _cached("stats", stats_key, _stats_table),
         Rule(style="blue"),
-        timers,
-        _window_panel(),
-        _events_panel(),
+        _cached("timers", since, lambda: _timers_row(since)),
+        _cached("window", since, lambda: _window_panel(since)),
+        _cached("events", STATE.events_version, _events_panel),
     )
     return Panel(group, border_style="cyan")
 
+def ui_mode() -> str:
+    """'rich', 'json' or 'off'."""
+    if FORWARDER_UI in ("rich", "1", "on", "true", "yes"):
+        return "rich"
+    if FORWARDER_UI in ("json", "ndjson", "headless"):
+        return "json"
+    if FORWARDER_UI in ("0", "off", "false", "no"):
+        return "off"
+    return "rich" if sys.stdout.isatty() else "json"
+
 def ui_thread():
-    # Stable full-screen render (no scroll)
-    with Live(render_ui(), refresh_per_second=5, console=console, transient=False, screen=True) as live:
+    # Stable full-screen render (no scroll), redrawn on change rather than on a timer
+    with Live(render_ui(), console=console, auto_refresh=False, transient=False, screen=True) as live:
+        drawn = None
         while not STOP_EVENT.is_set():
-            live.update(render_ui(), refresh=True)
-            time.sleep(0.2)
+            key = (STATE.version, _since_last_bid(datetime.now(timezone.utc)))
+            if key != drawn:
+                drawn = key
+                live.update(render_ui(), refresh=True)
+            # Sleep until the next STATE write or the next second boundary (countdown tick)
+            STATE.changed.wait(1.0 - time.time() % 1.0)
+            STATE.changed.clear()
+            time.sleep(1.0 / UI_MAX_FPS)
+
+# ============== HEADLESS (NDJSON status stream) ==============
+# One JSON object per stdout line, in the shape server.js hands to its
+# WebSocket clients: {"type": "status", "data": {...}} when STATE changed
+# (at most every STATUS_INTERVAL, plus a heartbeat) and {"type": "log", ...}
+# for every push_event.
+_EVENT_LEVELS = {"red": "error", "yellow": "warning", "green": "success"}
+
+def _uptime() -> str:
+    secs = int(time.monotonic() - STARTED_AT)
+    h, rem = divmod(secs, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}h {m}m {s}s" if h else (f"{m}m {s}s" if m else f"{s}s")
+
+def status_snapshot() -> Dict[str, Any]:
+    last_at = STATE["last_bid_at"]
+    return {
+        "connected": STATE["connected"],
+        "status": "running",
+        "role": STATE["role"],
+        "forwarded_count": STATE["forwarded_count"],
+        "parsed_count": STATE["parsed_count"],
+        "last_bid_seen": STATE["last_bid_seen"],
+        "last_tag": STATE["last_tag"],
+        "last_bid_at": last_at.isoformat() if last_at else None,
+        "last_error": STATE["last_error"] or None,
+        "queue_depth": STATE["queue_depth"],
+        "queue_peak": STATE["queue_peak"],
+        "db_batches": STATE["db_batches"],
+        "forward_backlog": STATE["forward_backlog"],
+        "routes": {r.name: {"source": r.source, "targets": r.targets, "posts": r.posts,
+                            "bids": r.bids, "forwarded": r.forwarded} for r in list(ROUTES.values())},
+        "uptime": _uptime(),
+    }
+
+def headless_thread():
+    out = sys.stdout
+    def emit(obj: Dict[str, Any]) -> None:
+        out.write(json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+
+    sent_version, sent_seq, sent_at = -1, 0, 0.0
+    while True:
+        stopping = STOP_EVENT.is_set()
+        for seq, ts, txt, style in reversed(list(STATE["events"])):
+            if seq > sent_seq:
+                sent_seq = seq
+                emit({"type": "log", "level": _EVENT_LEVELS.get(style, "info"), "message": txt, "ts": ts})
+        now = time.monotonic()
+        if STATE.version != sent_version or now - sent_at >= STATUS_HEARTBEAT:
+            sent_version, sent_at = STATE.version, now
+            emit({"type": "status", "data": status_snapshot()})
+        out.flush()
+        if stopping:
+            break
+        STATE.changed.wait(STATUS_HEARTBEAT)
+        STATE.changed.clear()
+        STOP_EVENT.wait(STATUS_INTERVAL)
+
+# ============== ROUTING ==============
+# Which source chats are ingested, where their posts are copied and how they
+# are parsed. Loaded once from FORWARDER_ROUTES (or the single
+# TELEGRAM_SOURCE_CHAT_ID -> TELEGRAM_TARGET_GROUP_ID pair) and looked up by
+# chat id per update.
+#
+#   {"routes": [{"name": "usps", "source": -1001..., "targets": [-1002...],
+#                "profile": "usps_bid", "tags": {"PA": [-1003...]}}]}
+
+# Parse profiles a route can name; None = forward only (no DB row, no notification)
+PARSE_PROFILES: Dict[str, Optional[Callable[[str], Optional[Dict[str, Any]]]]] = {
+    "usps_bid": parse_bid,
+    "forward_only": None,
+}
+
+class Route:
+    __slots__ = ("name", "source", "targets", "profile", "parser", "tag_targets", "shard",
+                 "posts", "bids", "forwarded")
+
+    def __init__(self, name: str, source: int, targets: List[int], profile: str = "usps_bid",
+                 tag_targets: Optional[Dict[str, List[int]]] = None, shard: int = 0):
+        self.name = name
+        self.source = source
+        self.targets = targets
+        self.profile = profile
+        self.parser = PARSE_PROFILES[profile]
+        self.tag_targets = {t.upper(): ids for t, ids in (tag_targets or {}).items()}
+        self.shard = shard
+        self.posts = self.bids = self.forwarded = 0
+
+    def targets_for(self, tag: Optional[str]) -> List[int]:
+        """The route's targets plus any tag fan-out targets, without duplicates."""
+        extra = self.tag_targets.get(tag.upper(), ()) if tag else ()
+        return list(dict.fromkeys([*self.targets, *extra]))
+
+# Replaced, never mutated, once the UI/status thread runs (run_ha swaps in a
+# shard's table), so that thread can iterate whichever dict it picked up
+ROUTES: Dict[int, Route] = {}
+
+def _chat_ids(value: Any, what: str) -> List[int]:
+    values = value if isinstance(value, list) else [value]
+    try:
+        return [int(v) for v in values]
+    except (TypeError, ValueError):
+        raise ValueError(f"{what}: chat ids must be integers, got {value!r}")
+
+def load_routes(config: str = ROUTES_CONFIG) -> Dict[int, Route]:
+    """Build the routing table from FORWARDER_ROUTES (file path or inline JSON). Raises ValueError."""
+    if not config:
+        if not SOURCE_CHAT_ID or not TARGET_CHAT_ID:
+            return {}
+        return {SOURCE_CHAT_ID: Route("default", SOURCE_CHAT_ID, [TARGET_CHAT_ID])}
+    try:
+        if config.startswith(("{", "[")):
+            data = json.loads(config)
+        else:
+            with open(config, encoding="utf-8") as f:
+                data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"FORWARDER_ROUTES: {e}")
+    entries = data.get("routes", []) if isinstance(data, dict) else data
+    routes: Dict[int, Route] = {}
+    for i, entry in enumerate(entries):
+        name = str(entry.get("name") or f"route{i + 1}")
+        if "source" not in entry:
+            raise ValueError(f"route {name}: missing source")
+        source = _chat_ids(entry["source"], f"route {name} source")[0]
+        targets = _chat_ids(entry.get("targets", entry.get("target", [])), f"route {name} targets")
+        profile = entry.get("profile", "usps_bid")
+        if profile not in PARSE_PROFILES:
+            raise ValueError(f"route {name}: unknown profile {profile!r} (have {', '.join(PARSE_PROFILES)})")
+        tags = {str(tag).lstrip("#"): _chat_ids(ids, f"route {name} tag {tag}")
+                for tag, ids in (entry.get("tags") or {}).items()}
+        if not targets and not tags:
+            raise ValueError(f"route {name}: no targets")
+        if source in routes:
+            raise ValueError(f"route {name}: source {source} already routed by {routes[source].name}")
+        shard = entry.get("shard", i % HA_SHARDS)
+        if isinstance(shard, bool) or not isinstance(shard, int) or not 0 <= shard < HA_SHARDS:
+            raise ValueError(f"route {name}: shard must be 0..{HA_SHARDS - 1} (HA_SHARDS={HA_SHARDS})")
+        routes[source] = Route(name, source, targets, profile, tags, shard)
+    return routes
+
+_UNROUTED_SEEN: set = set()
+
+def note_unrouted(chat_id: int) -> None:
+    M_ROUTE_POSTS.labels("unrouted").inc()
+    if chat_id not in _UNROUTED_SEEN:  # once per chat, not once per post
+        _UNROUTED_SEEN.add(chat_id)
+        push_event(f"Ignored channel id {chat_id} (no route)", "yellow")
+        log.info("Ignoring posts from channel %s: no route", chat_id)
+
+async def on_unrouted_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat is not None:
+        note_unrouted(update.effective_chat.id)
 
 # ============== HANDLER (permissive; filter inside) ==============
+def bid_record(parsed: Dict[str, Any], received_at: datetime, route: Optional["Route"] = None) -> Dict[str, Any]:
+    """telegram_bids row for a parsed bid; its 30-minute window starts at received_at."""
+    return {
+        "bid_number": str(parsed["bid"]),
+        "distance_miles": parsed.get("miles"),
+        "pickup_timestamp": parsed.get("pickup_timestamp"),
+        "delivery_timestamp": parsed.get("delivery_timestamp"),
+        "stops": parsed.get("stops") or [],
+        "tag": parsed.get("tag"),
+        "source_channel": str(route.source if route else SOURCE_CHAT_ID),
+        "forwarded_to": str(route.targets[0] if route and route.targets else TARGET_CHAT_ID),
+        "received_at": received_at,
+        "expires_at": received_at + timedelta(minutes=COUNTDOWN_MINUTES),
+    }
+
+async def forward_post(bot, chat_id: int, item: tuple) -> None:
+    """Copy a (route, message_id) source post to chat_id (one attempt; the forward scheduler retries)."""
+    route, message_id = item
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            bot.copy_message(chat_id=chat_id, from_chat_id=route.source, message_id=message_id),
+            FORWARD_TIMEOUT,
+        )
+    except Exception as e:
+        outcome = "retry_after" if isinstance(e, RetryAfter) else "error"
+        M_COPY_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+        raise
+    M_COPY_SECONDS.labels("ok").observe(time.perf_counter() - started)
+    route.forwarded += 1
+    M_ROUTE_FORWARDS.labels(route.name, str(chat_id)).inc()
+    STATE["forwarded_count"] += 1
+    STATE["last_src_msg_id"] = message_id
+    push_event(f"Forwarded post {message_id} ({route.name} → {chat_id})", "green")
+    log.info("Forwarded message %s from %s → %s (%s)", message_id, route.source, chat_id, route.name)
+
+def parse_post(text: str, parser: Callable[[str], Optional[Dict]] = None,
+               trace: Optional[BidTrace] = None) -> Optional[Dict]:
+    """Run a route's parser with metrics (and a trace span); the parsed bid or None."""
+    started_ns = time.time_ns()
+    parsed = (parser or parse_bid)(text)
+    parsed_ns = time.time_ns()
+    M_PARSE_SECONDS.observe((parsed_ns - started_ns) / 1e9)
+    if trace:
+        trace.span("parse", started_ns, parsed_ns)
+    if parsed:
+        M_BIDS_PARSED.inc()
+    else:
+        M_PARSE_MISSES.inc()
+    return parsed
+
+async def store_bid(parsed: Dict[str, Any], received_at: datetime, trace: Optional[BidTrace] = None,
+                    route: Optional["Route"] = None) -> None:
+    """Record a parsed bid in STATE and queue it for the DB (the queue owns the trace from here)."""
+    STATE["parsed_count"] += 1
+    STATE["last_bid_seen"] = parsed["bid"]
+    STATE["last_tag"] = parsed.get("tag")
+    if not POSTGRES_ENABLED:
+        _note_bid_window(received_at)  # otherwise set by the upsert, for new bids only
+    if route is not None:
+        route.bids += 1
+        M_ROUTE_BIDS.labels(route.name).inc()
+    tag_note = f" #{parsed['tag']}" if parsed.get("tag") else ""
+    push_event(f"Parsed bid {parsed['bid']}{tag_note}", "cyan")
+    log.info("Parsed bid: %s", parsed)
+
+    # DB upsert
+    if POSTGRES_ENABLED:
+        record = bid_record(parsed, received_at, route)
+        if trace:
+            trace.attrs["bid.number"] = record["bid_number"]
+            record["_trace"] = trace
+        await enqueue_bid(record)
+    elif trace:
+        trace.finish("parsed")
+
+async def ingest_post(text: str, received_at: datetime, trace: Optional[BidTrace] = None,
+                      route: Optional["Route"] = None) -> Optional[Dict]:
+    """Parse a source post and queue its bid for the DB. Returns the parsed bid, if any."""
+    M_POSTS.inc()
+    if route is not None and route.parser is None:
+        if trace:
+            trace.finish("forward_only")
+        return None
+    parsed = parse_post(text, route.parser if route else None, trace)
+    if not parsed:
+        if trace:
+            trace.finish("not_bid")
+        return None
+    await store_bid(parsed, received_at, trace, route)
+    return parsed
+
+def _forward_done(message_id: int, target: int, trace: Optional[BidTrace], started_ns: int,
+                  waiter: "asyncio.Future[bool]") -> None:
+    error = None
+    if waiter.cancelled():
+        error = "cancelled"
+    elif waiter.exception() is not None:
+        e = waiter.exception()
+        error = str(e) or type(e).__name__
+        M_ERRORS.labels("forward").inc()
+        STATE["last_error"] = f"Forward of post {message_id} to {target} failed: {error}"
+        push_event(f"Forward of post {message_id} to {target} failed: {error}", "red")
+        log.warning("Forward of message %s to %s failed: %s", message_id, target, error)
+    elif not waiter.result():
+        error = "not sent before shutdown"
+    if trace:
+        # From submit to sent: includes time spent queued behind the rate limits
+        trace.span("telegram.copy_message", started_ns, time.time_ns(), error, target=target)
+
+def forward_submit(route: "Route", message_id: int, targets: List[int], trace: Optional[BidTrace] = None) -> None:
+    """Hand a source post to the forward scheduler, once per target; an unsent earlier version (edit) is coalesced."""
+    if FORWARDER is None:
+        log.warning("Forward scheduler not running; post %s not forwarded", message_id)
+        return
+    submitted_ns = time.time_ns()
+    for target in targets:
+        waiter = FORWARDER.submit(target, (route.source, message_id), (route, message_id))
+        waiter.add_done_callback(functools.partial(_forward_done, message_id, target, trace, submitted_ns))
+
+async def _persist_step(parsed: Optional[Dict[str, Any]], received_at: datetime, message_id: int,
+                        route: "Route", trace: Optional[BidTrace]) -> None:
+    if not parsed:
+        if trace:
+            trace.finish("not_bid" if route.parser else "forward_only")
+        if route.parser:
+            push_event("Post didn’t match bid pattern; forwarded only.", "dim")
+            log.info("Message did not match bid pattern; forwarded only.")
+        return
+    try:
+        await asyncio.wait_for(store_bid(parsed, received_at, trace, route), INGEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        M_ERRORS.labels("ingest").inc()
+        STATE["last_error"] = f"Post {message_id} not queued for the DB within {INGEST_TIMEOUT:g}s"
+        push_event(f"Post {message_id} not queued for the DB ({INGEST_TIMEOUT:g}s); replay it from the ingest log", "red")
+        log.error("Post %s not queued for the DB within %ss; it is in the ingest log for --replay",
+                  message_id, INGEST_TIMEOUT)
+        if trace:
+            trace.finish("ingest_timeout", "ingest timed out")
+
 async def on_source_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    trace: Optional[BidTrace] = None
     try:
         msg: Optional[Message] = update.effective_message or update.channel_post or update.edited_channel_post
         chat = update.effective_chat
         if not msg or not chat:
             return
-
-        # Only process messages from the configured source channel
-        if chat.id != SOURCE_CHAT_ID:
-            if chat.type == "channel":
-                push_event(f"Ignored channel id {chat.id} (expect {SOURCE_CHAT_ID})", "yellow")
+        route = ROUTES.get(chat.id)
+        if route is None:  # the handler's chat filter normally keeps these out
             return
+        route.posts += 1
+        M_ROUTE_POSTS.labels(route.name).inc()
+        M_POSTS.inc()
 
         text = msg.text or msg.caption or ""
+        received_at = datetime.now(timezone.utc)
+        edited = update.edited_channel_post is not None
+        ingest_log_append(msg.message_id, chat.id, (msg.edit_date if edited else None) or msg.date,
+                          received_at, text, edited)
+        if trace_log.handlers:
+            trace = BidTrace((msg.edit_date if edited else None) or msg.date,
+                             **{"telegram.message_id": msg.message_id, "telegram.edited": edited,
+                                "route": route.name})
 
-        # 1) Copy original post to target group
-        try:
-            await context.bot.copy_message(
-                chat_id=TARGET_CHAT_ID,
-                from_chat_id=SOURCE_CHAT_ID,
-                message_id=msg.message_id,
-            )
-            STATE["forwarded_count"] += 1
-            STATE["last_src_msg_id"] = msg.message_id
-            push_event(f"Forwarded post {msg.message_id}", "green")
-            log.info("Forwarded message %s from %s → %s", msg.message_id, SOURCE_CHAT_ID, TARGET_CHAT_ID)
-        except Exception as e:
-            STATE["last_error"] = f"Forward failed: {e}"
-            push_event(f"Forward failed: {e}", "red")
-            log.warning("Forward failed: %s", e)
-
-        # 2) Parse potential bid (tolerant)
-        parsed = parse_bid(text)
-        if parsed:
-            STATE["parsed_count"] += 1
-            STATE["last_bid_seen"] = parsed["bid"]
-            STATE["last_tag"] = parsed.get("tag")
-            STATE["last_bid_at"] = datetime.now(timezone.utc)
-            tag_note = f" #{parsed['tag']}" if parsed.get("tag") else ""
-            push_event(f"Parsed bid {parsed['bid']}{tag_note}", "cyan")
-            log.info("Parsed bid: %s", parsed)
-
-            # DB upsert
-            if POSTGRES_ENABLED:
-                now = datetime.now(timezone.utc)
-                record = {
-                    "bid_number": str(parsed["bid"]),
-                    "distance_miles": parsed.get("miles"),
-                    "pickup_timestamp": parsed.get("pickup_timestamp"),
-                    "delivery_timestamp": parsed.get("delivery_timestamp"),
-                    "stops": parsed.get("stops") or [],
-                    "tag": parsed.get("tag"),
-                    "source_channel": str(SOURCE_CHAT_ID),
-                    "forwarded_to": str(TARGET_CHAT_ID),
-                    "received_at": now,
-                    "expires_at": now + timedelta(minutes=COUNTDOWN_MINUTES),
-                }
-                await db_upsert_bid(record)
-        else:
-            push_event("Post didn’t match bid pattern; forwarded only.", "dim")
-            log.info("Message did not match bid pattern; forwarded only.")
+        # Parsing takes microseconds and decides the tag fan-out. After that,
+        # copying to the targets and persisting are independent: the forward
+        # scheduler sends in the background (paced, in source order) while
+        # the bid goes on to telegram_bids and the outbox
+        parsed = parse_post(text, route.parser, trace) if route.parser else None
+        forward_submit(route, msg.message_id, route.targets_for(parsed.get("tag") if parsed else None), trace)
+        persisting, trace = trace, None  # the steps own it now
+        await _persist_step(parsed, received_at, msg.message_id, route, persisting)
     except Exception as e:
+        M_ERRORS.labels("handler").inc()
         STATE["last_error"] = str(e)
         push_event(f"Handler error: {e}", "red")
         log.exception("Handler error")
+        if trace:
+            trace.finish("error", str(e))
+
+# ============== STARTUP CATCH-UP ==============
+# Posts that arrived while the bot was down are pulled with getUpdates before
+# polling starts and handled as one batch: expired bids are dropped, bids
+# already in telegram_bids are skipped, the rest are upserted in multi-row
+# batches, and their forwards go to the forward scheduler in posting order.
+
+async def db_existing_bid_numbers(bid_numbers: List[str]) -> set:
+    if not POSTGRES_ENABLED or DB_POOL is None or not bid_numbers:
+        return set()
+    try:
+        async with DB_POOL.connection() as conn:
+            cur = await conn.execute(
+                "select bid_number from public.telegram_bids where bid_number = any(%s)", (bid_numbers,)
+            )
+            return {row[0] for row in await cur.fetchall()}
+    except Exception as e:
+        log.warning("Catch-up dedupe lookup failed (%s); treating all bids as new", e)
+        return set()
+
+async def catch_up_page(updates: List[Update], totals: Dict[str, int]) -> bool:
+    """Store one page of the startup backlog and queue its forwards.
+
+    Returns False if a batch could not be stored (nothing of the page is forwarded).
+    """
+    # Latest version of each routed post, in posting order (an edit replaces its original)
+    posts: Dict[tuple, Message] = {}
+    now = datetime.now(timezone.utc)
+    for u in updates:
+        msg = u.channel_post or u.edited_channel_post
+        if msg is None:
+            continue
+        if msg.chat_id not in ROUTES:
+            note_unrouted(msg.chat_id)
+            continue
+        posts[(msg.chat_id, msg.message_id)] = msg
+        ingest_log_append(msg.message_id, msg.chat_id, msg.edit_date or msg.date, msg.date,
+                          msg.text or msg.caption or "", u.edited_channel_post is not None)
+
+    records: List[Dict[str, Any]] = []
+    to_forward: List[tuple] = []  # (chat id, message id, route, tag)
+    bid_posts: List[tuple] = []
+    expired = 0
+    for (chat_id, message_id), msg in posts.items():
+        route = ROUTES[chat_id]
+        route.posts += 1
+        M_ROUTE_POSTS.labels(route.name).inc()
+        M_POSTS.inc()
+        parsed = parse_post(msg.text or msg.caption or "", route.parser) if route.parser else None
+        if not parsed:
+            to_forward.append((chat_id, message_id, route, None))
+            continue
+        # The bid's window started when it was posted, not when we came back up
+        record = bid_record(parsed, msg.date, route)
+        if record["expires_at"] <= now:
+            # Too late to bid on or notify, but the target group still mirrors the channel
+            expired += 1
+            to_forward.append((chat_id, message_id, route, record["tag"]))
+            continue
+        bid_posts.append((chat_id, message_id, route, record))
+
+    existing = await db_existing_bid_numbers([r["bid_number"] for *_, r in bid_posts])
+    for chat_id, message_id, route, record in bid_posts:
+        to_forward.append((chat_id, message_id, route, record["tag"]))
+        if record["bid_number"] in existing:
+            continue
+        records.append(record)
+        route.bids += 1
+        M_ROUTE_BIDS.labels(route.name).inc()
+    to_forward.sort(key=lambda f: (f[0], f[1]))
+
+    for i in range(0, len(records), INGEST_BATCH_SIZE):
+        if not await db_upsert_bids(records[i:i + INGEST_BATCH_SIZE]):
+            return False
+    STATE["parsed_count"] += len(records)
+    if records:
+        last = records[-1]
+        STATE["last_bid_seen"], STATE["last_tag"] = int(last["bid_number"]), last["tag"]
+        if not POSTGRES_ENABLED:
+            _note_bid_window(last["received_at"])
+
+    for _, message_id, route, tag in to_forward:
+        forward_submit(route, message_id, route.targets_for(tag))
+    totals["posts"] += len(posts)
+    totals["stored"] += len(records)
+    totals["expired"] += expired
+    totals["existing"] += len(bid_posts) - len(records)
+    totals["forwards"] += len(to_forward)
+    return True
+
+async def catch_up(bot) -> None:
+    # A webhook left by a push-mode run makes getUpdates fail; pending updates survive this
+    await bot.delete_webhook(drop_pending_updates=False)
+    # getUpdates with offset N confirms every update below N, so the next page is only
+    # asked for once the current one is stored; the call that comes back empty confirms the last
+    totals = {"posts": 0, "stored": 0, "expired": 0, "existing": 0, "forwards": 0}
+    offset: Optional[int] = None
+    pages = 0
+    while True:
+        batch = await bot.get_updates(offset=offset, timeout=0, limit=100, allowed_updates=Update.ALL_TYPES)
+        if not batch:
+            break
+        pages += 1
+        if not await catch_up_page(batch, totals):
+            # Leave this page unconfirmed: polling delivers it again to the handler,
+            # which stores and forwards each post (already stored bids come back unchanged)
+            push_event(f"Catch-up: DB write failed; {len(batch)}+ updates left to polling", "red")
+            log.error("Catch-up upsert failed; not confirming update %d onwards", batch[0].update_id)
+            return
+        offset = batch[-1].update_id + 1
+    if not pages:
+        return
+
+    summary = (f"Catch-up: {totals['posts']} posts, {totals['stored']} bids stored, {totals['expired']} expired, "
+               f"{totals['existing']} already stored, {totals['forwards']} forwards queued")
+    push_event(summary, "cyan")
+    log.info(summary)
+
+# ============== REPLAY ==============
+async def replay_ingest_log(paths: List[str], speed: float = 0.0, restamp: bool = False) -> Dict[str, Any]:
+    """Feed a raw ingest log through parse -> upsert -> notify (no Telegram forwarding).
+
+    speed 0 replays as fast as the DB accepts (the ingest queue applies
+    backpressure); otherwise post spacing is divided by speed (1 = real time).
+    restamp stamps bids with the current time instead of the original
+    received_at, for load tests (bids whose stored window has closed are
+    re-opened under fresh outbox keys).
+    """
+    await db_pool_open()
+    await http_client_open()
+    await ingest_start()
+    await outbox_start()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first_ts: Optional[float] = None
+    updates = bids = 0
+    try:
+        for entry in read_ingest_log(paths):
+            ts = entry.get("ts")
+            if speed > 0 and ts is not None:
+                if first_ts is None:
+                    first_ts = ts
+                delay = started + (ts - first_ts) / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if restamp:
+                received_at = datetime.now(timezone.utc)
+            else:
+                received_at = datetime.fromtimestamp(entry.get("rx") or ts or time.time(), timezone.utc)
+            updates += 1
+            if await ingest_post(entry.get("text") or "", received_at, route=ROUTES.get(entry.get("chat"))):
+                bids += 1
+    finally:
+        await ingest_stop(timeout=None)
+        await outbox_stop()
+        await http_client_close()
+        await db_pool_close()
+    return {"updates": updates, "bids": bids, "seconds": loop.time() - started}
+
+# ============== TRACE SUMMARY ==============
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values), max(1, math.ceil(q * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+def trace_summary(paths: List[str], target_ms: float = 1000.0) -> str:
+    """Per-day end-to-end percentiles (post date -> notified) plus per-stage timings."""
+    per_day: Dict[str, Dict[str, List[float]]] = {}
+    per_stage: Dict[str, List[float]] = {}
+    outcomes: Dict[str, int] = {}
+    for path in paths:
+        for name in rotated_log_files(path):
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        continue
+                    for rs in request.get("resourceSpans", []):
+                        for ss in rs.get("scopeSpans", []):
+                            spans = ss.get("spans", [])
+                            root = next((sp for sp in spans if "parentSpanId" not in sp), None)
+                            for sp in spans:
+                                if sp is not root:
+                                    per_stage.setdefault(sp["name"], []).append(
+                                        (int(sp["endTimeUnixNano"]) - int(sp["startTimeUnixNano"])) / 1e6)
+                            if root is None:
+                                continue  # late stage span of an already written trace
+                            attrs = {a["key"]: next(iter(a["value"].values())) for a in root.get("attributes", [])}
+                            outcome = attrs.get("outcome", "unknown")
+                            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                            if outcome not in ("notified", "stored"):
+                                continue
+                            start, end = int(root["startTimeUnixNano"]), int(root["endTimeUnixNano"])
+                            entry = int(attrs.get("handler.entry_unix_nano", start))
+                            day = datetime.fromtimestamp(start / 1e9, CENTRAL_TZ).date().isoformat()
+                            d = per_day.setdefault(day, {"e2e": [], "pipeline": []})
+                            d["e2e"].append((end - start) / 1e6)
+                            d["pipeline"].append((end - entry) / 1e6)
+
+    out = [f"End-to-end bid latency by day (America/Chicago), post date -> notified/stored, target {target_ms:.0f} ms",
+           f"{'day':<12}{'bids':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'<=target':>10}"
+           f"{'pipe p50':>10}{'pipe p99':>10}"]
+    for day in sorted(per_day):
+        e2e, pipe = sorted(per_day[day]["e2e"]), sorted(per_day[day]["pipeline"])
+        within = sum(1 for v in e2e if v <= target_ms) / len(e2e) * 100
+        out.append(f"{day:<12}{len(e2e):>6}{_percentile(e2e, .5):>9.0f}{_percentile(e2e, .9):>9.0f}"
+                   f"{_percentile(e2e, .99):>9.0f}{e2e[-1]:>9.0f}{within:>9.1f}%"
+                   f"{_percentile(pipe, .5):>10.0f}{_percentile(pipe, .99):>10.0f}")
+    if not per_day:
+        out.append("(no completed bid traces)")
+    out += ["", "Stages (all days, ms)", f"{'stage':<24}{'count':>8}{'p50':>10}{'p99':>10}"]
+    for stage in sorted(per_stage):
+        v = sorted(per_stage[stage])
+        out.append(f"{stage:<24}{len(v):>8}{_percentile(v, .5):>10.1f}{_percentile(v, .99):>10.1f}")
+    out += ["", "Outcomes: " + (", ".join(f"{k}={outcomes[k]}" for k in sorted(outcomes)) or "none"),
+            "Times in ms. The post date has 1 s resolution, so e2e includes up to 1 s of rounding;",
+            "'pipe' starts at handler entry and is exact."]
+    return "\n".join(out)
+
+# ============== WEBHOOK RECEIVER (push mode) ==============
+# TELEGRAM_UPDATES=webhook: a stdlib HTTP server (same approach as the metrics
+# endpoint) takes Telegram's POSTs, checks the secret token and puts each
+# update on the application's update queue, so it reaches the same handlers
+# as a polled one. Telegram retries anything not answered with 200.
+MAX_UPDATE_BYTES = 1024 * 1024
+
+class _UpdateReceiver(http.server.BaseHTTPRequestHandler):
+    application = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _reply(self, status: int, text: str = "") -> None:
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != TELEGRAM_WEBHOOK_PATH:
+            self._reply(404, "not found")
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), TELEGRAM_WEBHOOK_SECRET.encode()):
+            M_ERRORS.labels("receiver").inc()
+            log.warning("Rejected webhook update from %s: bad secret token", self.client_address[0])
+            self._reply(403, "forbidden")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_UPDATE_BYTES:
+            self._reply(413 if length > 0 else 400, "bad length")
+            return
+        try:
+            data = json.loads(self.rfile.read(length))
+            # Unrouted channels are acknowledged without building an Update
+            post = data.get("channel_post") or data.get("edited_channel_post")
+            chat_id = (post or {}).get("chat", {}).get("id")
+            if chat_id is not None and chat_id not in ROUTES:
+                note_unrouted(chat_id)
+                self._reply(200)
+                return
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            M_ERRORS.labels("receiver").inc()
+            log.warning("Rejected webhook update: %s", e)
+            self._reply(400, "bad update")
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.application.update_queue.put(update), self.loop).result(5)
+        except Exception as e:
+            M_ERRORS.labels("receiver").inc()
+            log.warning("Webhook update %s not queued: %s", data.get("update_id"), e)
+            self._reply(503, "not ready")  # Telegram redelivers
+            return
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        log.debug("receiver: " + format, *args)
+
+def receiver_start(application, loop: asyncio.AbstractEventLoop) -> http.server.ThreadingHTTPServer:
+    _UpdateReceiver.application, _UpdateReceiver.loop = application, loop
+    server = http.server.ThreadingHTTPServer((TELEGRAM_WEBHOOK_ADDR, TELEGRAM_WEBHOOK_PORT), _UpdateReceiver)
+    threading.Thread(target=server.serve_forever, name="update-receiver", daemon=True).start()
+    log.info("Webhook receiver on http://%s:%d%s", TELEGRAM_WEBHOOK_ADDR, TELEGRAM_WEBHOOK_PORT, TELEGRAM_WEBHOOK_PATH)
+    return server
+
+async def wait_for_stop(still_leader: Optional[Callable[[], Any]] = None) -> None:
+    """Return on STOP_EVENT, or (HA) as soon as still_leader() reports the lock was lost."""
+    loop = asyncio.get_running_loop()
+    while not await loop.run_in_executor(None, STOP_EVENT.wait, HA_CHECK_SECONDS):
+        if still_leader is not None and not await still_leader():
+            return
+
+async def run_webhook(application, still_leader: Optional[Callable[[], Any]] = None) -> None:
+    """Push-mode counterpart of run_polling: same application, handlers and post_init/post_stop."""
+    loop = asyncio.get_running_loop()
+    async with application:  # initialize / shutdown
+        await application.post_init(application)
+        server = receiver_start(application, loop)
+        try:
+            if TELEGRAM_WEBHOOK_URL:
+                await application.bot.set_webhook(
+                    TELEGRAM_WEBHOOK_URL,
+                    secret_token=TELEGRAM_WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+                    drop_pending_updates=not CATCHUP_ON_START,
+                )
+                log.info("Webhook registered: %s", TELEGRAM_WEBHOOK_URL)
+            else:
+                log.warning("TELEGRAM_WEBHOOK_URL not set; receiver only, nothing registered with Telegram")
+            await application.start()
+            await wait_for_stop(still_leader)
+            await application.stop()
+        finally:
+            server.shutdown()
+            server.server_close()
+            await application.post_stop(application)
+
+def post_updates(paths: List[str]) -> int:
+    """POST recorded updates (JSON object, array, or one per line) to the local receiver."""
+    url = f"http://{TELEGRAM_WEBHOOK_ADDR}:{TELEGRAM_WEBHOOK_PORT}{TELEGRAM_WEBHOOK_PATH}"
+    failed = 0
+    with httpx.Client(timeout=10, headers={"X-Telegram-Bot-Api-Secret-Token": TELEGRAM_WEBHOOK_SECRET}) as client:
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                raw = f.read().strip()
+            try:
+                loaded = json.loads(raw)
+                updates = loaded if isinstance(loaded, list) else [loaded]
+            except json.JSONDecodeError:
+                updates = [json.loads(line) for line in raw.splitlines() if line.strip()]
+            for u in updates:
+                response = client.post(url, json=u)
+                print(f"update {u.get('update_id')}: HTTP {response.status_code}")
+                failed += response.status_code != 200
+    return failed
+
+# ============== HIGH AVAILABILITY (leader election) ==============
+# Telegram lets one consumer poll a bot token. With FORWARDER_HA=1 every replica
+# starts warm (parser loaded, DB pool and webhook client open) and tries
+# pg_try_advisory_lock on a key derived from its bot token; the winner polls,
+# the rest retry every HA_RETRY_SECONDS. The lock lives as long as the winner's
+# dedicated session, so a crashed or redeployed leader frees it at once and a
+# standby takes over, starting with catch-up of whatever Telegram still holds.
+
+def ha_lock_key(token: str) -> int:
+    """Stable signed 64-bit advisory lock key for a bot token."""
+    digest = hashlib.blake2b(f"nova-forwarder:{token}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+def ha_shard_tokens() -> List[str]:
+    return [BOT_TOKEN] + [os.getenv(f"TELEGRAM_BOT_TOKEN_{k}", "") for k in range(1, HA_SHARDS)]
+
+class LeaderLock:
+    """Session-level advisory locks on one dedicated connection (pool connections are shared and recycled)."""
+
+    def __init__(self, keys: List[int]):
+        self.keys = keys
+        self.conn: Optional[psycopg.AsyncConnection] = None
+        self.key: Optional[int] = None
+
+    async def _connect(self) -> psycopg.AsyncConnection:
+        if self.conn is None or self.conn.closed:
+            self.conn = await psycopg.AsyncConnection.connect(
+                HA_DATABASE_URL, autocommit=True, prepare_threshold=None, connect_timeout=10,
+                application_name="nova-forwarder-ha",
+                # A leader that drops off the network must lose its session (and lock) quickly
+                keepalives=1, keepalives_idle=10, keepalives_interval=5, keepalives_count=3,
+            )
+        return self.conn
+
+    async def acquire(self) -> Optional[int]:
+        """Index of the first key won; waits until one is free. None once STOP_EVENT is set."""
+        loop = asyncio.get_running_loop()
+        while not STOP_EVENT.is_set():
+            try:
+                conn = await self._connect()
+                for i, key in enumerate(self.keys):
+                    cur = await conn.execute("select pg_try_advisory_lock(%s)", (key,))
+                    if (await cur.fetchone())[0]:
+                        self.key = key
+                        return i
+            except psycopg.Error as e:
+                M_ERRORS.labels("ha").inc()
+                log.warning("Leader lock attempt failed: %s", e)
+                await self.close()
+            await loop.run_in_executor(None, STOP_EVENT.wait, HA_RETRY_SECONDS)
+        return None
+
+    async def held(self) -> bool:
+        """False once the lock session is gone (the lock went with it)."""
+        try:
+            await asyncio.wait_for((await self._connect()).execute("select 1"), HA_CHECK_SECONDS)
+            return self.conn is not None and self.key is not None
+        except (psycopg.Error, asyncio.TimeoutError) as e:
+            M_ERRORS.labels("ha").inc()
+            log.error("Leader lock session lost: %s", e)
+            await self.close()
+            return False
+
+    async def release(self) -> None:
+        if self.key is None:
+            return
+        key, self.key = self.key, None
+        try:
+            if self.conn is not None and not self.conn.closed:
+                await self.conn.execute("select pg_advisory_unlock(%s)", (key,))
+        except psycopg.Error as e:
+            log.warning("Leader lock release failed (it goes with the session): %s", e)
+            await self.close()
+
+    async def close(self) -> None:
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                await conn.close()
+            except psycopg.Error:
+                pass
+        self.key = None
+
+async def run_polling_until(application, still_leader: Callable[[], Any]) -> None:
+    """run_polling for one leadership term; returns when stopped or the lock is lost."""
+    async with application:
+        await application.post_init(application)
+        try:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES,
+                                                    drop_pending_updates=not CATCHUP_ON_START)
+            await application.start()
+            await wait_for_stop(still_leader)
+            await application.updater.stop()
+            await application.stop()
+        finally:
+            await application.post_stop(application)
+
+async def run_ha() -> None:
+    """Standby until this replica wins a lock, serve that shard's routes, repeat on lock loss."""
+    global ROUTES
+    tokens = ha_shard_tokens()
+    all_routes = dict(ROUTES)
+    lock = LeaderLock([ha_lock_key(t) for t in tokens])
+    # Warm standby: everything but polling is ready before the lock is won
+    await db_pool_open()
+    await http_client_open()
+    try:
+        while not STOP_EVENT.is_set():
+            STATE["role"] = "standby"
+            push_event("Standby: waiting for the leader lock", "yellow")
+            shard = await lock.acquire()
+            if shard is None:
+                break
+            ROUTES = {src: r for src, r in all_routes.items() if r.shard == shard}
+            STATE["role"] = "active" if HA_SHARDS == 1 else f"active (shard {shard})"
+            push_event(f"Leader lock acquired; {STATE['role']} with {len(ROUTES)} route(s)", "green")
+            log.info("Leader lock acquired (shard %s, routes: %s)", shard, ", ".join(r.name for r in ROUTES.values()))
+            application = build_application(tokens[shard])
+            try:
+                if TELEGRAM_UPDATES == "webhook":
+                    await run_webhook(application, lock.held)
+                else:
+                    await run_polling_until(application, lock.held)
+            finally:
+                await lock.release()
+            if not STOP_EVENT.is_set():
+                push_event("Leader lock lost; stopped polling", "red")
+    finally:
+        await lock.close()
+        STATE["role"] = "standby"
+        await http_client_close()
+        await db_pool_close()
 
 # ============== MAIN ==============
+def _parse_cli_datetime(value: str) -> datetime:
+    dt = datetime.fromisoformat(value)
+    return to_central(dt) if dt.tzinfo is None else dt
+
+def build_application(token: str):
+    """The bot application with the route handlers and the pipeline's post_init/post_stop."""
+    application = ApplicationBuilder().token(token).build()
+    routed = filters.Chat(chat_id=list(ROUTES))
+    application.add_handler(MessageHandler(filters.ChatType.CHANNEL & routed, on_source_message))
+    application.add_handler(MessageHandler(filters.ChatType.CHANNEL & filters.UpdateType.EDITED_CHANNEL_POST & routed, on_source_message))
+    application.add_handler(MessageHandler(filters.ChatType.CHANNEL & ~routed, on_unrouted_message), group=1)
+
+    async def _post_init(app):
+        await db_pool_open()
+        await http_client_open()
+        await ingest_start()
+        await outbox_start()
+        forward_start(app.bot)
+        if CATCHUP_ON_START:
+            try:
+                await catch_up(app.bot)
+            except Exception as e:
+                M_ERRORS.labels("catchup").inc()
+                # Whatever is left is delivered to the handler by polling
+                push_event(f"Catch-up failed: {str(e)[:60]}", "red")
+                log.exception("Startup catch-up failed")
+        STATE["connected"] = True
+        push_event("Polling started." if TELEGRAM_UPDATES == "polling" else "Webhook receiver started.", "green")
+    async def _post_stop(app):
+        STATE["connected"] = False
+        await forward_stop()
+        await ingest_stop()
+        await outbox_stop()
+        if not HA_ENABLED:  # standbys keep them warm; run_ha closes them
+            await http_client_close()
+            await db_pool_close()
+    application.post_init = _post_init
+    application.post_stop = _post_stop
+    return application
+
 def main():
+    parser = argparse.ArgumentParser(description="NOVA Telegram forwarder")
+    parser.add_argument("--renormalize-timestamps", action="store_true",
+                        help="re-stamp stored pickup/delivery times from the old fixed UTC-5 offset to America/Chicago, then exit")
+    parser.add_argument("--before", type=_parse_cli_datetime,
+                        help="with --renormalize-timestamps: only rows received before this ISO time (deploy of DST-aware parsing)")
+    parser.add_argument("--since", type=_parse_cli_datetime,
+                        help="with --renormalize-timestamps: only rows received at or after this ISO time")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--replay", nargs="+", metavar="LOG",
+                        help="feed raw ingest log(s) (rotated backups included) through parse/upsert/notify, then exit")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="with --replay: time-scaling factor (1 = original pacing, 10 = 10x; 0 = as fast as the DB allows)")
+    parser.add_argument("--restamp", action="store_true",
+                        help="with --replay: stamp bids with the current time instead of when they were first received")
+    parser.add_argument("--trace-summary", nargs="*", metavar="TRACE_FILE",
+                        help="print per-day end-to-end latency percentiles from trace file(s) (default TRACE_PATH), then exit")
+    parser.add_argument("--target-ms", type=float, default=1000.0,
+                        help="with --trace-summary: latency target to report the share of bids within")
+    parser.add_argument("--post-update", nargs="+", metavar="UPDATE_JSON",
+                        help="POST recorded Telegram update JSON to a running webhook receiver, then exit")
+    args = parser.parse_args()
+
+    if args.post_update:
+        sys.exit(1 if post_updates(args.post_update) else 0)
+
+    if args.trace_summary is not None:
+        paths = args.trace_summary or [TRACE_PATH]
+        missing = [p for p in paths if not rotated_log_files(p)]
+        if missing:
+            parser.error(f"no trace file at {', '.join(missing)}")
+        print(trace_summary(paths, args.target_ms))
+        return
+
+    # Run preflight checks before starting the bot; failures must reach
+    # stderr (the supervisor's log), not only the log file
+    preflight_handler = logging.StreamHandler(sys.stderr)
+    preflight_handler.setLevel(logging.WARNING)
+    logging.getLogger().addHandler(preflight_handler)
+    try:
+        preflight_database_check()
+    finally:
+        logging.getLogger().removeHandler(preflight_handler)
+
+    if args.renormalize_timestamps:
+        if args.before is None:
+            parser.error("--renormalize-timestamps requires --before")
+        changed = renormalize_stored_timestamps(args.before, args.since, dry_run=args.dry_run)
+        print(f"{'Would re-normalize' if args.dry_run else 'Re-normalized'} {changed} telegram_bids row(s)")
+        return
+
+    try:
+        ROUTES.update(load_routes())
+    except ValueError as e:
+        parser.error(str(e))
+
+    metrics_start()
+
+    if args.replay:
+        missing = [p for p in args.replay if not rotated_log_files(p)]
+        if missing:
+            parser.error(f"no ingest log at {', '.join(missing)}")
+        if args.speed < 0:
+            parser.error("--speed must be >= 0")
+        stats = asyncio.run(replay_ingest_log(args.replay, speed=args.speed, restamp=args.restamp))
+        rate = stats["updates"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+        print(f"Replayed {stats['updates']} update(s), {stats['bids']} bid(s) in {stats['seconds']:.1f}s ({rate:,.0f} updates/s)")
+        return
+
+    require_telegram_config()
+    if TELEGRAM_UPDATES not in ("polling", "webhook"):
+        parser.error("TELEGRAM_UPDATES must be polling or webhook")
+    if TELEGRAM_UPDATES == "webhook" and not TELEGRAM_WEBHOOK_SECRET:
+        parser.error("TELEGRAM_UPDATES=webhook requires TELEGRAM_WEBHOOK_SECRET")
+    if HA_SHARDS < 1 or (HA_SHARDS > 1 and not HA_ENABLED):
+        parser.error("HA_SHARDS > 1 requires FORWARDER_HA=1")
+    if HA_ENABLED and not HA_DATABASE_URL:
+        parser.error("FORWARDER_HA=1 requires HA_DATABASE_URL (a direct or session-mode connection)")
+    if HA_ENABLED and is_transaction_pooler(HA_DATABASE_URL):
+        parser.error("HA_DATABASE_URL points at a transaction-mode pooler (port 6543 or pgbouncer=true); "
+                     "advisory locks need a direct or session-mode connection")
+    if HA_ENABLED and HA_SHARDS > 1:
+        tokens = ha_shard_tokens()
+        if not all(tokens) or len(set(tokens)) != len(tokens):
+            parser.error(f"HA_SHARDS={HA_SHARDS} needs a distinct TELEGRAM_BOT_TOKEN_k for each shard k >= 1")
+    ingest_log_open()
+    trace_log_open()
+
     # graceful shutdown
     def _sig_handler(sig, frame):
         STOP_EVENT.set()
     signal.signal(signal.SIGINT, _sig_handler)
     signal.signal(signal.SIGTERM, _sig_handler)
 
-    # start UI thread first (stable full-screen live)
-    t = threading.Thread(target=ui_thread, daemon=True)
-    t.start()
-
-    # build app & handlers
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
-    application.add_handler(MessageHandler(filters.ChatType.CHANNEL, on_source_message))
-    application.add_handler(MessageHandler(filters.ChatType.CHANNEL & filters.UpdateType.EDITED_CHANNEL_POST, on_source_message))
-
-    async def _post_init(app): STATE["connected"] = True; push_event("Polling started.", "green")
-    async def _post_stop(app): STATE["connected"] = False
-    application.post_init = _post_init
-    application.post_stop = _post_stop
+    # start UI thread first: Rich dashboard on a TTY, NDJSON status stream otherwise
+    t: Optional[threading.Thread] = None
+    mode = ui_mode()
+    if mode == "rich":
+        t = threading.Thread(target=ui_thread, daemon=True)
+    elif mode == "json":
+        t = threading.Thread(target=headless_thread, daemon=True)
+    if t is not None:
+        t.start()
+    log.info("Status output: %s", mode)
 
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
-            close_loop=True,
-        )
+        if HA_ENABLED:
+            asyncio.run(run_ha())
+        elif TELEGRAM_UPDATES == "webhook":
+            asyncio.run(run_webhook(build_application(BOT_TOKEN)))
+        else:
+            build_application(BOT_TOKEN).run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=not CATCHUP_ON_START,
+                close_loop=True,
+            )
     finally:
         STOP_EVENT.set()
-        t.join(timeout=1.0)
+        STATE.changed.set()
+        if t is not None:
+            t.join(timeout=1.0)
+        ingest_log_close()
+        trace_log_close()
 
 if __name__ == "__main__":
     main()
@@ -7,6 +7,8 @@ from telethon.sessions import StringSession
 from telethon.errors import ChannelPrivateError, UsernameNotOccupiedError, FloodWaitError
 from telethon.tl.types import PeerChannel, PeerChat, PeerUser
 
+from forward_scheduler import ForwardScheduler  # same send queue as telegram_bot_forwarder.py
+
 # Load ~/.nova_telegram.env
 load_dotenv(os.path.expanduser("~/.nova_telegram.env"))
 
@@ -118,40 +120,58 @@ async def main():
     print(f"   Source: {SOURCE_CHANNEL} → {src}")
     print(f"   Target: {TARGET_GROUP_ID} → {dst}")
 
+    async def send(_chat, msg):
+        if msg.message:
+            text = friendly_forward_text(msg.message)
+            await client.send_message(dst, text, link_preview=False)
+        elif msg.media:
+            # forward media as copy
+            await client.send_message(dst, msg)
+
+    def retry_delay(e, attempt):
+        # Flood waits delay the post (and everything queued behind it); other errors drop it
+        if isinstance(e, FloodWaitError):
+            print(f"Flood wait ({e.seconds}s), {scheduler.backlog} posts queued. Retrying after it...")
+            return e.seconds + 1
+        return None
+
+    def report(msg_id, waiter):
+        if not waiter.cancelled() and waiter.exception() is not None:
+            print(f"Error forwarding message {msg_id}:", waiter.exception())
+
+    scheduler = ForwardScheduler(send, retry_delay)
+    scheduler.start()
+
+    def forward(msg):
+        if msg.message or msg.media:
+            scheduler.submit(TARGET_GROUP_ID, msg.id, msg).add_done_callback(
+                lambda w, msg_id=msg.id: report(msg_id, w))
+
     # On new messages in source channel
     @client.on(events.NewMessage(chats=src))
     async def handler(event):
-        try:
-            msg = event.message
-            if msg.message:
-                text = friendly_forward_text(msg.message)
-                await client.send_message(dst, text, link_preview=False)
-            elif msg.media:
-                # forward media as copy
-                await client.send_message(dst, msg)
-        except FloodWaitError as e:
-            print(f"Flood wait ({e.seconds}s). Sleeping...")
-            await asyncio.sleep(e.seconds)
-        except Exception as e:
-            print("Error forwarding message:", e)
+        forward(event.message)
+
+    # An edit of a post that is still queued replaces it (sent posts are left alone)
+    @client.on(events.MessageEdited(chats=src))
+    async def edit_handler(event):
+        scheduler.update(TARGET_GROUP_ID, event.message.id, event.message)
 
     # Backfill last ~20 posts on start (optional)
     print("Backfilling last 20 posts...")
     try:
         async for message in client.iter_messages(src, limit=20, reverse=True):
-            try:
-                if message.message:
-                    text = friendly_forward_text(message.message)
-                    await client.send_message(dst, text, link_preview=False)
-                elif message.media:
-                    await client.send_message(dst, message)
-            except Exception as e:
-                print("Backfill send error:", e)
+            forward(message)
     except ChannelPrivateError:
         print("Cannot read from source: private channel? Make sure your account has access.")
     print("Listening for new posts...")
 
-    await client.run_until_disconnected()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        left = await scheduler.stop()
+        if left:
+            print(f"{left} posts not forwarded before shutdown")
 
 if __name__ == "__main__":
     asyncio.run(main())